@@ -5,12 +5,13 @@ Created on Tue Jul 26 16:28:19 2022
 @author: Original template by Rolf van Lieshout
 """
 from Solution import Solution
+from LocalSearch import LocalSearch
 import random, time
 import math
 import matplotlib.pyplot as plt
 import pandas as pd
 import os
-from Parameters import Parameters
+from Config import Config
 
 import matplotlib.pyplot as plt
 import matplotlib.cm as cm
@@ -38,32 +39,57 @@ class ALNS:
         The best solution currently found
     bestDistance : int
         Distance of the best solution
+    cost : list of tuples
+        (iteration, distance of the solution found in the iteration)
+    costcu : list of tuples
+        (iteration, distance of the best solution after the iteration)
+    temperature : float
+        temperature of the simulated annealing, startTemperature at the start of the run
+    startTime : float
+        time (time.perf_counter) at which the run started
+    nIterationsDone : int
+        number of iterations executed by execute
+    candidatePool : CandidatePool
+        processes that generate the candidate solutions if config.nCandidates > 1
+    config : Config
+        parameters of the run, by default the current values of Parameters
 
     """
-    def __init__(self,problem,nDestroyOps,nRepairOps):
+    def __init__(self,problem,nDestroyOps,nRepairOps,config=None):
         self.problem = problem
+        self.config = config if config is not None else Config.fromParameters()
         self.nDestroyOps = nDestroyOps
         self.nRepairOps = nRepairOps
         self.destroyOpsWeigths = [(i, 5) for i in range(1, self.nDestroyOps + 1)]
         self.repairOpsWeigths = [(i, 5) for i in range(1, self.nRepairOps + 1)]
-        self.randomGen = random.Random(Parameters.randomSeed) #used for reproducibility
+        self.randomGen = random.Random(self.config.randomSeed) #used for reproducibility
+        self.localSearch = LocalSearch(problem,config=self.config)
+        self.candidatePool = None #created when the first iteration with candidates is executed
         
     
     def constructInitialSolution(self):
         """
         Method that constructs an initial solution using random insertion
         """
-        self.currentSolution = Solution(self.problem,list(),list(),list(self.problem.requests.copy()))
+        self.startTime = time.perf_counter()
+        self.currentSolution = Solution(self.problem,list(),list(),list(self.problem.requests.copy()),self.config)
         #self.currentSolution.executeRandomInsertion(self.randomGen)
         self.currentSolution.executeGreedyInsertion(self.randomGen)
         #self.currentSolution.executeRegretInsertion(self.randomGen)
+        if self.config.twoOptOnAccept:
+            self.currentSolution.ApplyTwoOpt()
         self.currentSolution.computeDistance()
         self.bestSolution = self.currentSolution.copy()
         self.bestDistance = self.currentSolution.distance
+        self.cost = [] #distance found in every iteration
+        self.costcu = [] #distance of the best solution after every iteration
         ###
-        w = Parameters.startTempControl
+        w = self.config.startTempControl
         z = self.bestDistance
         self.temperature = - (w * z) / math.log(0.5) # P = e ** (-w.z)/tstart  so tstart = -(w *z) / ln(0.5)
+        self.startTemperature = self.temperature
+        self.bestAtStall = self.bestDistance #best distance when the last new global best was found
+        self.lastImprovement = 0 #iteration in which it was found
         
         print(self.temperature)
         
@@ -72,43 +98,155 @@ class ALNS:
         
     def execute(self):
         """
-        Method that executes the ALNS
+        Method that executes the ALNS until isFinished. Returns the best solution found,
+        which is also kept in bestSolution
         """
-        cost = []
-        costcu = []
         starttime = time.time() # get the start time
         self.constructInitialSolution()
-        for i in range(Parameters.nIterations):
-            #copy the current solution
-            self.tempSolution = self.currentSolution.copy()
-            #decide on the size of the neighbourhood
-            sizeNBH = self.randomGen.randint(Parameters.minSizeNBH,Parameters.maxSizeNBH)
-            #decide on the destroy and repair operator numbers
-            if not Parameters.overrideOpr:
-                destroyOpNr = self.determineDestroyOpNr()
-                repairOpNr = self.determineRepairOpNr()
-            elif Parameters.overrideOpr:
-                destroyOpNr = Parameters.destroy
-                repairOpNr = Parameters.repair
-            #execute the destroy and the repair and evaluate the result
-            self.destroyAndRepair(destroyOpNr, repairOpNr, sizeNBH);
-            self.tempSolution.computeDistance()
-            self.iterationPrint(i, destroyOpNr, repairOpNr, sizeNBH)
-            #print("Iteration "+str(i)+": (destroy: " + str(destroyOpNr) + ", repair: " + str(repairOpNr) + ", NHB size: " + str(sizeNBH) + ") Found solution with distance: "+str(self.tempSolution.distance))
-            #self.tempSolution.print()
-            #determine if the new solution is accepted
-            state = self.checkIfAcceptNewSol()
-            #update the ALNS weights
-            cost.append((i,self.tempSolution.distance))
-            costcu.append((i,self.bestSolution.distance))
-            self.updateWeights(state, destroyOpNr, repairOpNr)
+        i = 0
+        while not self.isFinished(i):
+            self.iterate(i)
+            i += 1
+        self.nIterationsDone = i
         endtime = time.time() # get the end time
         self.cpuTime = round(endtime-starttime)
-        print("Terminated. Final distance: "+str(self.bestSolution.distance)+", cpuTime: "+str(self.cpuTime)+" seconds")
+        if self.candidatePool is not None:
+            self.candidatePool.close()
+            self.candidatePool = None
+        print("Terminated after "+str(i)+" iterations. Final distance: "+str(self.bestSolution.distance)+", cpuTime: "+str(self.cpuTime)+" seconds")
         #self.plot_routes()
         
-        # self.drawGraph(cost)
-        # self.drawGraph(costcu)
+        # self.drawGraph(self.cost)
+        # self.drawGraph(self.costcu)
+        return self.bestSolution
+        
+    def isFinished(self,i):
+        """
+        Method that returns True if the ALNS stops before iteration i: when config.timeBudget 
+        seconds have passed since the start of the run if it is set, and else after 
+        config.nIterations iterations; or, if config.stallIterations is set, after that many 
+        iterations without a new global best
+        """
+        if self.bestDistance < self.bestAtStall:
+            self.bestAtStall = self.bestDistance
+            self.lastImprovement = i
+        if self.config.stallIterations is not None and i - self.lastImprovement >= self.config.stallIterations:
+            return True
+        if self.config.timeBudget is not None:
+            return self.elapsedTime() >= self.config.timeBudget
+        return i >= self.config.nIterations
+        
+    def elapsedTime(self):
+        """
+        Method that returns the wall-clock time in seconds since the start of the run
+        """
+        return time.perf_counter() - self.startTime
+        
+    def coolDown(self):
+        """
+        Method that lowers the temperature after an iteration. Without a time budget it is 
+        multiplied by config.coolingRate. With a time budget it follows the same schedule on
+        the fraction of the budget that is used instead of the iteration count: 
+        startTemperature * coolingRate ** (fraction * nIterations), so the temperature at the
+        end of the run is the same for any budget.
+        """
+        if self.config.timeBudget is None:
+            self.temperature = self.temperature * self.config.coolingRate
+        else:
+            fraction = min(1.0,self.elapsedTime()/self.config.timeBudget)
+            self.temperature = self.startTemperature * self.config.coolingRate ** (fraction*self.config.nIterations)
+        
+    def iterate(self,i):
+        """
+        Method that executes iteration i of the ALNS: a destroy and repair of the current
+        solution, its acceptance and the update of the weights
+        """
+        if self.config.nCandidates > 1:
+            self.iterateCandidates(i)
+            return
+        #the move is made on the current solution, and undone if it is rejected
+        self.currentDistance = self.currentSolution.distance
+        self.currentSolution.beginMove()
+        self.tempSolution = self.currentSolution
+        sizeNBH, destroyOpNr, repairOpNr = self.determineMove()
+        #execute the destroy and the repair and evaluate the result
+        self.destroyAndRepair(destroyOpNr, repairOpNr, sizeNBH);
+        self.iterationPrint(i, destroyOpNr, repairOpNr, sizeNBH)
+        #print("Iteration "+str(i)+": (destroy: " + str(destroyOpNr) + ", repair: " + str(repairOpNr) + ", NHB size: " + str(sizeNBH) + ") Found solution with distance: "+str(self.tempSolution.distance))
+        #self.tempSolution.print()
+        #determine if the new solution is accepted
+        newDistance = self.tempSolution.distance
+        state = self.checkIfAcceptNewSol()
+        #update the ALNS weights
+        self.cost.append((i,newDistance))
+        self.costcu.append((i,self.bestSolution.distance))
+        self.updateWeights(state, destroyOpNr, repairOpNr)
+        
+    def iterateCandidates(self,i):
+        """
+        Method that executes iteration i of the ALNS with config.nCandidates candidate 
+        solutions. Each candidate is generated from the current solution with its own 
+        neighbourhood size, operators and random generator, seeded from randomGen, in the
+        processes of a ParallelALNS.CandidatePool. The best candidate is evaluated by the 
+        acceptance test, and the weights are updated for every candidate: the other candidates
+        are rewarded as a global best or better solution if they would be, and else as rejected.
+        The candidates only depend on the seed and config.nCandidates, not on the number of
+        processes.
+        """
+        if self.candidatePool is None:
+            from ParallelALNS import CandidatePool
+            self.candidatePool = CandidatePool(self.problem,self.nDestroyOps,self.nRepairOps,self.config,self.config.candidateWorkers)
+        self.currentDistance = self.currentSolution.distance
+        bestDistance = self.bestDistance
+        currentDistance = self.currentDistance
+        seeds = [self.randomGen.getrandbits(64) for b in range(self.config.nCandidates)]
+        candidates = self.candidatePool.generate(self.currentSolution,seeds,self.destroyOpsWeigths,self.repairOpsWeigths)
+        chosen = min(range(len(candidates)),key=lambda b: candidates[b]["distance"])
+        #the chosen candidate becomes the current solution, the previous one is kept in case it is rejected
+        previous = self.currentSolution
+        self.currentSolution = self.candidatePool.solution(candidates[chosen])
+        self.currentSolution.beginMove()
+        previousSequences = {tuple(route.nodeSequence()) for route in previous.routes}
+        self.currentSolution.ownedRoutes = {route for route in self.currentSolution.routes if tuple(route.nodeSequence()) not in previousSequences}
+        self.tempSolution = self.currentSolution
+        self.iterationPrint(i, candidates[chosen]["destroyOpNr"], candidates[chosen]["repairOpNr"], candidates[chosen]["sizeNBH"])
+        newDistance = self.tempSolution.distance
+        state = self.checkIfAcceptNewSol()
+        if state == "Rejected":
+            self.currentSolution = previous
+        self.cost.append((i,newDistance))
+        self.costcu.append((i,self.bestSolution.distance))
+        for b, candidate in enumerate(candidates):
+            if b == chosen:
+                outcome = state
+            elif candidate["distance"] < bestDistance:
+                outcome = "Global Best"
+            elif candidate["distance"] < currentDistance:
+                outcome = "Better Sol"
+            else:
+                outcome = "Rejected"
+            self.updateWeights(outcome, candidate["destroyOpNr"], candidate["repairOpNr"])
+        
+    def trace(self):
+        """
+        Method that returns the trace of the run: a tuple (iteration, distance found in the
+        iteration, distance of the best solution after the iteration) per iteration
+        """
+        return [(i,distance,best) for (i,distance), (j,best) in zip(self.cost,self.costcu)]
+        
+    def adoptSolution(self,solution):
+        """
+        Method that makes a solution found elsewhere (e.g. by another island of 
+        ParallelALNS.IslandALNS) the current solution if it is better than the current 
+        solution. Returns True if it is adopted.
+        """
+        if solution.distance >= self.currentSolution.distance:
+            return False
+        self.currentSolution = solution
+        if solution.distance < self.bestDistance:
+            self.bestDistance = solution.distance
+            self.bestSolution = solution.copy()
+        return True
         
     def drawGraph(self,data):
         x = [item[0] for item in data]
@@ -147,39 +285,56 @@ class ALNS:
 
     def checkIfAcceptNewSol(self):
         """
-        Method that checks if we accept the newly found solution
+        Method that checks if we accept the newly found solution. The new solution is the 
+        current solution after the move, the move is undone if the solution is rejected.
         """
 
         
   
         state = "Rejected"
+        changedRoutes = self.tempSolution.changedRoutes()
         #if we found a global best solution, we always accept
 
         if self.tempSolution.distance<self.bestDistance:
-            if Parameters.maketwoOpt:
-                self.currentSolution.ApplyTwoOpt()
+            if self.config.maketwoOpt:
+                self.tempSolution.ApplyTwoOpt()
+            if self.config.localSearch:
+                self.localSearch.improve(self.tempSolution)
             self.bestDistance = self.tempSolution.distance
             self.bestSolution = self.tempSolution.copy()
-            self.currentSolution = self.tempSolution.copy()
+            self.currentDistance = self.tempSolution.distance
             state = "Global Best"
             #self.tempSolution.ApplyTwoOpt()
             print("Found new global best solution.\n")
             
         
         #currently, we  accept better solution 
-        if self.tempSolution.distance<self.currentSolution.distance:
+        if self.tempSolution.distance<self.currentDistance:
 
-            self.currentSolution = self.tempSolution.copy()
+            self.currentDistance = self.tempSolution.distance
             state = "Better Sol"
 
         # simulated annealing
-        elif random.random() < math.e ** -((self.tempSolution.distance - self.currentSolution.distance)/ self.temperature):
-            self.currentSolution = self.tempSolution.copy()
+        elif self.randomGen.random() < math.e ** -((self.tempSolution.distance - self.currentDistance)/ self.temperature):
+            self.currentDistance = self.tempSolution.distance
             state = "Accepted"
             print("Accepeted the worse soulution")
             #print(self.temperature)
             
-        self.temperature = self.temperature * Parameters.coolingRate    
+        self.coolDown()
+        
+        if self.config.twoOptOnAccept and state != "Rejected":
+            #only the routes changed by the move can be improved, the others were improved before
+            self.tempSolution.ApplyTwoOpt([route for route in changedRoutes if route in self.tempSolution.routes])
+            self.currentDistance = self.tempSolution.distance
+            if self.tempSolution.distance < self.bestDistance:
+                self.bestDistance = self.tempSolution.distance
+                self.bestSolution = self.tempSolution.copy()
+        
+        if state == "Rejected":
+            self.currentSolution.rollbackMove()
+        else:
+            self.currentSolution.commitMove()
 
         return state
     
@@ -187,8 +342,8 @@ class ALNS:
         """
         Method that updates the weights of the destroy and repair operators
         """
-        reward = Parameters.reward[state]
-        updateSpeed = Parameters.updateSpeed
+        reward = self.config.rewardOf(state)
+        updateSpeed = self.config.updateSpeed
 
         # Update destroy weights
         oldWeight_d = self.destroyOpsWeigths[chosenDestroyOp-1][1]
@@ -204,6 +359,22 @@ class ALNS:
 
 
     
+    def determineMove(self):
+        """
+        Method that determines the size of the neighbourhood and the destroy and repair 
+        operators of an iteration, returns them as a tuple
+        """
+        #decide on the size of the neighbourhood
+        sizeNBH = self.randomGen.randint(self.config.minSizeNBH,self.config.maxSizeNBH)
+        #decide on the destroy and repair operator numbers
+        if not self.config.overrideOpr:
+            destroyOpNr = self.determineDestroyOpNr()
+            repairOpNr = self.determineRepairOpNr()
+        elif self.config.overrideOpr:
+            destroyOpNr = self.config.destroy
+            repairOpNr = self.config.repair
+        return sizeNBH, destroyOpNr, repairOpNr
+    
     def determineDestroyOpNr(self):
         """
         Method that determines the destroy operator that will be applied. 
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Immutable configuration of a run of the ALNS
+"""
+import json
+import dataclasses
+from dataclasses import dataclass
+from Parameters import Parameters
+try:
+    import tomllib
+except ImportError: #python < 3.11
+    tomllib = None
+
+
+@dataclass(frozen=True)
+class Config:
+    """
+    Class that holds the parameters of one run of the ALNS. The attributes have the same
+    names and meanings as those of Parameters, and their default values are the values
+    in Parameters when this module is imported. A Config can not be changed, so runs with
+    different configurations can be executed at the same time, e.g. in threads or in a
+    pool of processes. ALNS, Solution, Route and LocalSearch read their parameters from
+    the Config they are given; if they are not given one, they take a snapshot of the
+    current Parameters (fromParameters).
+
+    reward is stored as a tuple of (state, reward) pairs, use rewardOf to look one up.
+    """
+    maketwoOpt: bool = Parameters.maketwoOpt
+    twoOptOnAccept: bool = Parameters.twoOptOnAccept
+    localSearch: bool = Parameters.localSearch
+    nIterations: int = Parameters.nIterations
+    timeBudget: float = Parameters.timeBudget
+    stallIterations: int = Parameters.stallIterations
+    minSizeNBH: int = Parameters.minSizeNBH
+    maxSizeNBH: int = Parameters.maxSizeNBH
+    randomSeed: int = Parameters.randomSeed
+    nCandidates: int = Parameters.nCandidates
+    candidateWorkers: int = Parameters.candidateWorkers
+    migrationInterval: int = Parameters.migrationInterval
+    reward: tuple = tuple(Parameters.reward.items())
+    updateSpeed: float = Parameters.updateSpeed
+    startTempControl: float = Parameters.startTempControl
+    coolingRate: float = Parameters.coolingRate
+    useBattery: bool = Parameters.useBattery
+    tightenTimeWindows: bool = Parameters.tightenTimeWindows
+    useInstanceCache: bool = Parameters.useInstanceCache
+    instanceCacheDir: str = Parameters.instanceCacheDir
+    p: float = Parameters.p
+    Regretk: int = Parameters.Regretk
+    compactRoutes: bool = Parameters.compactRoutes
+    routeCacheSize: int = Parameters.routeCacheSize
+    checkDistances: bool = Parameters.checkDistances
+    vectorizedInsertion: bool = Parameters.vectorizedInsertion
+    vectorizeMinLength: int = Parameters.vectorizeMinLength
+    granularity: int = Parameters.granularity
+    alpha: float = Parameters.alpha
+    fullShaw: bool = Parameters.fullShaw
+    shawWeights: tuple = Parameters.shawWeights
+    overrideOpr: bool = Parameters.overrideOpr
+    destroy: int = Parameters.destroy
+    repair: int = Parameters.repair
+
+    def __post_init__(self):
+        #values read from a file or from Parameters are dicts and lists, they are stored as tuples
+        if isinstance(self.reward,dict):
+            object.__setattr__(self,"reward",tuple(self.reward.items()))
+        else:
+            object.__setattr__(self,"reward",tuple(tuple(pair) for pair in self.reward))
+        object.__setattr__(self,"shawWeights",tuple(self.shawWeights))
+
+    def rewardOf(self,state):
+        """
+        Method that returns the reward of a state of the acceptance ("Global Best",
+        "Better Sol", "Accepted" or "Rejected")
+        """
+        for name, reward in self.reward:
+            if name == state:
+                return reward
+        raise Exception(f"No reward for state {state}")
+
+    def replace(self,**changes):
+        """
+        Method that returns a copy of the configuration with some values changed
+        """
+        return dataclasses.replace(self,**changes)
+
+    def asDict(self):
+        """
+        Method that returns the values of the configuration as a dict, with reward as a dict
+        """
+        values = dataclasses.asdict(self)
+        values["reward"] = dict(self.reward)
+        return values
+
+    @staticmethod
+    def fromParameters():
+        """
+        Method that returns the configuration with the current values of Parameters
+        """
+        return Config(**{field.name: getattr(Parameters,field.name) for field in dataclasses.fields(Config)})
+
+    @staticmethod
+    def fromDict(values,base=None):
+        """
+        Method that returns the configuration base (by default the current values of
+        Parameters) with the values in the dict changed. Unknown names raise an exception.
+        """
+        if base is None:
+            base = Config.fromParameters()
+        names = {field.name for field in dataclasses.fields(Config)}
+        unknown = [name for name in values if name not in names]
+        if len(unknown) > 0:
+            raise Exception(f"Unknown parameters in configuration: {', '.join(unknown)}")
+        return base.replace(**values)
+
+    @staticmethod
+    def load(fileName,base=None):
+        """
+        Method that reads a configuration from a .toml or .json file, see fromDict.
+        The file only needs to contain the values that differ from base.
+        """
+        if fileName.endswith(".toml"):
+            if tomllib is None:
+                raise Exception("Reading .toml files requires python 3.11 or later")
+            with open(fileName,"rb") as file:
+                values = tomllib.load(file)
+        else:
+            with open(fileName) as file:
+                values = json.load(file)
+        return Config.fromDict(values,base)
+
+    def save(self,fileName):
+        """
+        Method that writes the configuration to a .json file
+        """
+        with open(fileName,"w") as file:
+            json.dump(self.asDict(),file,indent=4)
@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""
+Runs the ALNS on a grid of instances, parameter values and seeds in a pool of processes,
+and writes the result of every run to a csv file as soon as it is finished. Runs that are
+in the ResultStore already are not executed again.
+"""
+import os
+import csv
+import json
+import time
+import hashlib
+import traceback
+import itertools
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+from Problem import PDPTW
+from ALNS import ALNS
+from Config import Config
+from ResultStore import ResultStore, configValues, jsonValue
+from ParallelALNS import routeSequences
+
+
+#instances read by a worker process, such that they are read once per process
+workerProblems = dict()
+
+
+def readProblem(fileName,config):
+    """
+    Method that returns the instance in a file, read once per process for every
+    configuration of the instance
+    """
+    key = (fileName,config.tightenTimeWindows,config.useInstanceCache,config.instanceCacheDir)
+    if key not in workerProblems:
+        workerProblems[key] = PDPTW.readInstance(fileName,config)
+    return workerProblems[key]
+
+
+def configHash(config,nDestroyOps,nRepairOps):
+    """
+    Method that returns a short hash of the values of the configuration that change the result
+    (ResultStore.configValues), the number of operators and the code of the solver 
+    (ResultStore.codeHash)
+    """
+    values = json.dumps(configValues(config),sort_keys=True,default=jsonValue)
+    content = "|".join([values,str(nDestroyOps),str(nRepairOps),ResultStore.codeHash()])
+    return hashlib.sha1(content.encode()).hexdigest()[:16]
+
+
+def cellValue(value):
+    """
+    Method that returns a value of the grid as it is written in the csv file
+    """
+    return "" if value is None else str(value)
+
+
+def cellConfig(cell,config):
+    """
+    Method that returns the configuration of a cell (instance, parameter values, seed)
+    """
+    instance, values, seed = cell
+    return config.replace(randomSeed=seed,**values)
+
+
+def cellRow(cell,result):
+    """
+    Method that returns the row of a cell with the result of its run, the row also holds
+    the routes and the trace of the run, which are not written to the csv file
+    """
+    instance, values, seed = cell
+    row = {"instance": os.path.basename(instance)}
+    row.update(values)
+    row["seed"] = seed
+    row.update(result)
+    return row
+
+
+def runCell(cell,config,nDestroyOps,nRepairOps):
+    """
+    Method that executes the ALNS for a cell (instance, parameter values, seed) of the grid.
+    Returns the row with the result.
+    """
+    config = cellConfig(cell,config)
+    problem = readProblem(cell[0],config)
+    alns = ALNS(problem,nDestroyOps,nRepairOps,config)
+    starttime = time.process_time()
+    with open(os.devnull,"w") as devnull, contextlib.redirect_stdout(devnull):
+        alns.execute()
+    best = alns.bestSolution
+    return cellRow(cell,{"best_distance": best.distance,
+                         "n_routes": len(best.routes),
+                         "n_not_served": len(best.notServed),
+                         "cpu_time": time.process_time() - starttime,
+                         "routes": routeSequences(best),
+                         "trace": alns.trace()})
+
+
+def storedCells(cells,config,nDestroyOps,nRepairOps,store):
+    """
+    Method that looks up the cells in the store (a ResultStore or None). Returns the rows of
+    the stored cells and the cells that have to be executed.
+    """
+    if store is None:
+        return [], list(cells)
+    rows = []
+    todo = []
+    for cell in cells:
+        result = store.get(cell[0],cellConfig(cell,config),nDestroyOps,nRepairOps)
+        if result is None:
+            todo.append(cell)
+        else:
+            rows.append(cellRow(cell,result))
+    return rows, todo
+
+
+def storeRow(cell,row,config,nDestroyOps,nRepairOps,store):
+    """
+    Method that adds the result of an executed cell to the store (a ResultStore or None)
+    """
+    if store is not None:
+        store.put(cell[0],cellConfig(cell,config),nDestroyOps,nRepairOps,row)
+
+
+class ExperimentHarness:
+    """
+    Class that runs the ALNS for every combination of an instance, values of the parameters
+    in the grid and a seed. The runs are executed in a pool of processes, and every result
+    is appended to the output file as soon as it is available. Runs that are in the output
+    file already are skipped, so an interrupted experiment continues where it stopped.
+
+    Parameters
+    ----------
+    outputFile : str
+        csv file with a row per run: the instance, the values of the grid, the seed, the
+        best distance, the number of routes and unserved requests, the CPU time and the
+        configHash of the experiment. Rows with another hash, written with another base 
+        configuration or version of the code, are kept but not used.
+    instances : list of str
+        files of the instances
+    grid : dict
+        maps names of Config attributes to the lists of values that are tried
+    seeds : list of int
+        seeds of the runs
+    nWorkers : int
+        number of processes, by default the number of CPU cores, 0 to run in this process
+    config : Config
+        configuration of the attributes that are not in the grid, by default Parameters
+    nDestroyOps : int
+        number of destroy operators.
+    nRepairOps : int
+        number of repair operators.
+    storeFile : str
+        database of the ResultStore in which the runs are looked up and stored, None to 
+        execute every run
+    nStored : int
+        number of runs of the last execute that were taken from the store
+    configHash : str
+        hash of config, the number of operators and the code of the solver
+    failures : list of dicts
+        cells of the last execute that raised an exception: instance, values, seed, 
+        config_hash and the traceback. They are also appended to failedFile, and are not 
+        in the output file, so they are executed again by the next execute.
+    """
+    def __init__(self,outputFile,instances,grid,seeds,nWorkers=None,config=None,nDestroyOps=4,nRepairOps=3,
+                 storeFile="cache/results.sqlite"):
+        self.outputFile = outputFile
+        self.instances = list(instances)
+        self.grid = dict(grid)
+        self.seeds = list(seeds)
+        self.nWorkers = nWorkers if nWorkers is not None else os.cpu_count()
+        self.config = config if config is not None else Config.fromParameters()
+        self.nDestroyOps = nDestroyOps
+        self.nRepairOps = nRepairOps
+        self.storeFile = storeFile
+        self.nStored = 0
+        self.failures = []
+        self.failedFile = os.path.splitext(outputFile)[0] + "_failed.log"
+        self.configHash = configHash(self.config,nDestroyOps,nRepairOps)
+        self.fieldNames = ["instance"] + list(self.grid) + ["seed","best_distance","n_routes","n_not_served","cpu_time","config_hash"]
+
+    def cells(self):
+        """
+        Method that returns all cells of the grid as tuples (instance, values, seed)
+        """
+        names = list(self.grid)
+        return [(instance,dict(zip(names,values)),seed) for instance in self.instances
+                for values in itertools.product(*self.grid.values()) for seed in self.seeds]
+
+    def cellKey(self,instance,values,seed,configHash=None):
+        """
+        Method that returns the key of a cell, as the values are written in the output file,
+        by default for the configHash of the experiment
+        """
+        if configHash is None:
+            configHash = self.configHash
+        return (os.path.basename(instance),) + tuple(cellValue(values[name]) for name in self.grid) + (cellValue(seed),configHash)
+
+    def finishedCells(self):
+        """
+        Method that returns the keys of the cells in the output file
+        """
+        if not os.path.exists(self.outputFile):
+            return set()
+        with open(self.outputFile,newline="") as file:
+            reader = csv.DictReader(file)
+            if reader.fieldnames is not None and reader.fieldnames != self.fieldNames:
+                raise Exception(f"The columns of {self.outputFile} do not match the grid")
+            return {self.cellKey(row["instance"],row,row["seed"],row["config_hash"]) for row in reader}
+
+    def execute(self):
+        """
+        Method that executes the runs that are not in the output file yet
+        """
+        cells = self.cells()
+        finished = self.finishedCells()
+        todo = [cell for cell in cells if self.cellKey(*cell) not in finished]
+        print(f"{self.outputFile}: {len(cells)-len(todo)} of {len(cells)} runs done, executing {len(todo)} runs")
+        nOther = sum(key[-1] != self.configHash for key in finished)
+        if nOther > 0:
+            print(f"{nOther} runs in {self.outputFile} have another configuration or version of the code, they are not used")
+        if os.path.dirname(self.outputFile) != "":
+            os.makedirs(os.path.dirname(self.outputFile),exist_ok=True)
+        newFile = not os.path.exists(self.outputFile) or os.path.getsize(self.outputFile) == 0
+        starttime = time.perf_counter()
+        self.failures = []
+        with open(self.outputFile,"a",newline="") as file:
+            #the routes and the trace are only kept in the store
+            writer = csv.DictWriter(file,fieldnames=self.fieldNames,extrasaction="ignore")
+            if newFile:
+                writer.writeheader()
+            for done, row in enumerate(self.runCells(todo),1):
+                row["config_hash"] = self.configHash
+                writer.writerow(row)
+                file.flush()
+                print(f"[{done}/{len(todo)}] {row['instance']} {', '.join(f'{name}={row[name]}' for name in self.grid)} seed={row['seed']}: {row['best_distance']}")
+        self.wallTime = time.perf_counter() - starttime
+        if len(self.failures) > 0:
+            print(f"{len(self.failures)} runs failed, see {self.failedFile}; they are executed again by the next execute")
+
+    def recordFailure(self,cell,error):
+        """
+        Method that records a cell that raised an exception, with the traceback
+        """
+        instance, values, seed = cell
+        failure = {"instance": os.path.basename(instance), "values": values, "seed": seed,
+                   "config_hash": self.configHash, "traceback": error}
+        self.failures.append(failure)
+        print(f"{failure['instance']} {', '.join(f'{name}={value}' for name, value in values.items())} seed={seed} failed:\n{error}")
+        with open(self.failedFile,"a") as file:
+            file.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {failure['instance']} {values} seed={seed} config_hash={self.configHash}\n{error}\n")
+
+    def runCells(self,cells):
+        """
+        Method that yields the rows of the cells: first those in the store, then those that
+        are executed, in the order in which they finish. A cell that raises an exception is
+        recorded (recordFailure) and the other cells continue. If the iteration is
+        interrupted, the cells that did not start yet are cancelled.
+        """
+        store = ResultStore(self.storeFile) if self.storeFile is not None else None
+        try:
+            rows, todo = storedCells(cells,self.config,self.nDestroyOps,self.nRepairOps,store)
+            self.nStored = len(rows)
+            if store is not None:
+                print(f"{len(rows)} runs found in {self.storeFile}")
+            yield from rows
+            if self.nWorkers == 0:
+                for cell in todo:
+                    try:
+                        row = runCell(cell,self.config,self.nDestroyOps,self.nRepairOps)
+                    except Exception:
+                        self.recordFailure(cell,traceback.format_exc())
+                        continue
+                    storeRow(cell,row,self.config,self.nDestroyOps,self.nRepairOps,store)
+                    yield row
+                return
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("fork" if "fork" in methods else None)
+            with ProcessPoolExecutor(max_workers=self.nWorkers,mp_context=context) as pool:
+                futures = {pool.submit(runCell,cell,self.config,self.nDestroyOps,self.nRepairOps): cell for cell in todo}
+                try:
+                    for future in as_completed(futures):
+                        try:
+                            row = future.result()
+                        except Exception:
+                            #the traceback of the worker is in the cause of the exception
+                            self.recordFailure(futures[future],traceback.format_exc())
+                            continue
+                        storeRow(futures[future],row,self.config,self.nDestroyOps,self.nRepairOps,store)
+                        yield row
+                except (KeyboardInterrupt,GeneratorExit):
+                    #the cells that are running finish, the others are not started
+                    pool.shutdown(cancel_futures=True)
+                    raise
+        finally:
+            if store is not None:
+                store.close()
+
+    def results(self):
+        """
+        Method that returns the rows of the output file with the configHash of the experiment
+        as a DataFrame, in the order of the grid
+        """
+        df = pd.read_csv(self.outputFile)
+        #the keys are made from the values as they are written in the file
+        text = pd.read_csv(self.outputFile,dtype=str,keep_default_na=False)
+        order = {self.cellKey(*cell): k for k, cell in enumerate(self.cells())}
+        df["order"] = [order.get(self.cellKey(row["instance"],row,row["seed"],row["config_hash"]),len(order)) for row in text.to_dict("records")]
+        df = df[text["config_hash"] == self.configHash]
+        return df.sort_values("order").drop(columns=["order","config_hash"]).reset_index(drop=True)
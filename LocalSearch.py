@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+Local search between routes, used to improve good solutions found by the ALNS
+"""
+from Config import Config
+
+
+class LocalSearch:
+    """
+    Class that improves a solution with moves between two routes:
+        relocate: move a request to another route
+        exchange: swap two requests of different routes
+        2-opt*: exchange the tails of two routes
+    The moves are evaluated from the profiles of the routes (Route.computeProfiles),
+    without constructing routes:
+        relocate: the removal saving of the request, and Route.bestInsertion in the
+            other route, which checks every pickup and delivery position pair in 
+            constant time, so O(n^2) for a route with n locations
+        exchange: Route.bestInsertion of each request in the other route without the
+            other request, so O(n^2) for every pair of requests. The routes without
+            each of their requests are copied once per call, in O(n) per request.
+        2-opt*: the forward and backward summaries at the split positions, in constant
+            time per pair of split positions
+    The first improving move is applied, until no move improves.
+    With config.granularity, only moves that use granular arcs are evaluated.
+
+    The routes are replaced through Solution.substituteRoute, so the moves are
+    recorded in the journal of the solution.
+
+    Parameters
+    ----------
+    problem : PDPTW
+        the problem instance
+    epsilon : float
+        minimal improvement of a move, such that rounding errors are not seen as improvements
+    config : Config
+        parameters of the run, by default the current values of Parameters
+    """
+    def __init__(self,problem,epsilon=1e-9,config=None):
+        self.problem = problem
+        self.epsilon = epsilon
+        self.config = config if config is not None else Config.fromParameters()
+
+    def improve(self,solution):
+        """
+        Method that applies the operators to the solution until none of them improves it.
+        Returns the decrease in distance.
+        """
+        startDistance = solution.distance
+        improved = True
+        while improved:
+            improved = self.relocate(solution) or self.exchange(solution) or self.twoOptStar(solution)
+        return startDistance - solution.distance
+
+    def candidateRoutes(self,solution):
+        """
+        Method that returns the feasible routes that serve at least one request
+        """
+        return [route for route in solution.routes if route.feasible and len(route.requests) > 0]
+
+    def withoutRequest(self,route,request):
+        """
+        Method that returns a copy of the route without the request
+        """
+        reduced = route.copy()
+        reduced.removeRequest(request)
+        return reduced
+
+    def relocate(self,solution):
+        """
+        Method that moves a request to the best position in another route, if this
+        decreases the distance. Returns True if a move is applied.
+        """
+        routes = self.candidateRoutes(solution)
+        for route in routes:
+            savings = route.removalSavings()
+            for req in route.requests:
+                for other in routes:
+                    if other is route:
+                        continue
+                    i, j, newDist = other.bestInsertion(req)
+                    if i is None:
+                        continue
+                    if savings[req.ID] - (newDist - other.distance) > self.epsilon:
+                        solution.substituteRoute(route,self.withoutRequest(route,req))
+                        solution.substituteRoute(other,other.insertAt(req,i,j,newDist))
+                        return True
+        return False
+
+    def exchange(self,solution):
+        """
+        Method that swaps two requests of different routes, each inserted at its best
+        position in the other route, if this decreases the distance. Every pair costs two
+        calls of bestInsertion, O(n^2) for routes with n locations. Returns True if a
+        move is applied.
+        """
+        routes = self.candidateRoutes(solution)
+        #routes without each of their requests, the insertions in them are evaluated with their profiles
+        reduced = dict()
+        for route in routes:
+            for req in route.requests:
+                reduced[req] = self.withoutRequest(route,req)
+        for a in range(len(routes)):
+            route = routes[a]
+            for other in routes[a+1:]:
+                for req in route.requests:
+                    for otherReq in other.requests:
+                        i, j, newDist = reduced[req].bestInsertion(otherReq)
+                        if i is None:
+                            continue
+                        gain = route.distance - newDist + other.distance
+                        if gain <= self.epsilon:
+                            continue
+                        otherI, otherJ, otherNewDist = reduced[otherReq].bestInsertion(req)
+                        if otherI is None or gain - otherNewDist <= self.epsilon:
+                            continue
+                        solution.substituteRoute(route,reduced[req].insertAt(otherReq,i,j,newDist))
+                        solution.substituteRoute(other,reduced[otherReq].insertAt(req,otherI,otherJ,otherNewDist))
+                        return True
+        return False
+
+    def twoOptStar(self,solution):
+        """
+        Method that exchanges the tails of two routes, if this decreases the distance.
+        A route can only be split after a position where no request is picked up and not
+        yet delivered. With config.granularity, one of the new arcs should be granular. 
+        Returns True if a move is applied.
+        """
+        dist = self.problem.distances
+        granular = None
+        if self.config.granularity is not None:
+            granular = self.problem.getGranularArcs(self.config.granularity)[1]
+        battery = self.problem.battery if self.config.useBattery else float("inf")
+        routes = self.candidateRoutes(solution)
+        locations = dict()
+        for route in routes:
+            if route.arrivalTimes is None:
+                route.computeProfiles()
+            locations[route] = route.locations
+        for a in range(len(routes)):
+            route = routes[a]
+            last = len(locations[route])-1
+            for other in routes[a+1:]:
+                otherLast = len(locations[other])-1
+                total = route.distance + other.distance
+                for i in range(last):
+                    if route.openRequests[i] != 0:
+                        continue
+                    for j in range(otherLast):
+                        if other.openRequests[j] != 0 or (i == 0 and j == 0) or (i == last-1 and j == otherLast-1):
+                            continue
+                        if granular is not None and not (granular[locations[route][i].nodeID][locations[other][j+1].nodeID] or granular[locations[other][j].nodeID][locations[route][i+1].nodeID]):
+                            continue
+                        head = (route,locations[route],i)
+                        otherHead = (other,locations[other],j)
+                        newDist = self.joinDistance(head,otherHead,dist)
+                        otherNewDist = self.joinDistance(otherHead,head,dist)
+                        if total - newDist - otherNewDist <= self.epsilon or newDist > battery or otherNewDist > battery:
+                            continue
+                        if not self.joinFeasible(head,otherHead,dist) or not self.joinFeasible(otherHead,head,dist):
+                            continue
+                        solution.substituteRoute(route,self.join(head,otherHead,newDist))
+                        solution.substituteRoute(other,self.join(otherHead,head,otherNewDist))
+                        return True
+        return False
+
+    def joinDistance(self,head,tail,dist):
+        """
+        Method that returns the distance of the route that joins the locations of a route 
+        up to a position with the locations of another route after a position. head and 
+        tail are tuples (route, locations, position).
+        """
+        headRoute, headLocations, i = head
+        tailRoute, tailLocations, j = tail
+        tailLast = len(tailLocations)-1
+        if j+1 == tailLast:
+            #the arc towards the final depot is not counted
+            return headRoute.pathDistances[i]
+        arc = dist[headLocations[i].nodeID][tailLocations[j+1].nodeID]
+        return headRoute.pathDistances[i] + arc + tailRoute.pathDistances[tailLast] - tailRoute.pathDistances[j+1]
+
+    def joinFeasible(self,head,tail,dist):
+        """
+        Method that checks the time windows of the route that joins head and tail, see 
+        joinDistance. No request is open at the split positions, so the loads of the 
+        tail do not change.
+        """
+        headRoute, headLocations, i = head
+        tailRoute, tailLocations, j = tail
+        if j+1 == len(tailLocations)-1:
+            return True
+        curNode = headLocations[i]
+        nextNode = tailLocations[j+1]
+        arrival = max(nextNode.startTW, headRoute.arrivalTimes[i] + curNode.servTime + dist[curNode.nodeID][nextNode.nodeID])
+        return arrival <= tailRoute.latestTimes[j+1]
+
+    def join(self,head,tail,distance):
+        """
+        Method that returns the route that joins head and tail, see joinDistance
+        """
+        headRoute, headLocations, i = head
+        tailRoute, tailLocations, j = tail
+        locations = headLocations[:i+1] + tailLocations[j+1:]
+        requests = [req for req in headRoute.requests if headLocations.index(req.pickUpLoc) <= i]
+        requests += [req for req in tailRoute.requests if tailLocations.index(req.pickUpLoc) > j]
+        return type(headRoute)(locations,requests,self.problem,True,distance,headRoute.config)
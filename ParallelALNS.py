@@ -0,0 +1,392 @@
+# -*- coding: utf-8 -*-
+"""
+Runs the ALNS in parallel processes: independent runs with different seeds (MultiStartALNS),
+islands that exchange their best solutions (IslandALNS), or the candidate solutions of a
+single ALNS iteration (CandidatePool).
+Usage: python ParallelALNS.py [instance] [number of seeds] [number of processes] [islands]
+"""
+import os
+import sys
+import time
+import queue
+import random
+import traceback
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from Problem import PDPTW
+from Solution import Solution
+from ALNS import ALNS
+from Config import Config
+
+
+#problem and configuration of a worker process, set once per process by initWorker
+workerProblem = None
+workerConfig = None
+#ALNS of a worker process that generates candidate solutions, set by initCandidateWorker
+workerALNS = None
+
+
+def prepareProblem(problem,config):
+    """
+    Method that computes the data of the problem that is otherwise created when it is first
+    used, such that worker processes share it instead of each computing it again
+    """
+    problem.distances
+    problem.getRelatedness(config.alpha,config.fullShaw,config.shawWeights)
+    if config.granularity is not None:
+        problem.getGranularArcs(config.granularity)
+
+
+def initWorker(problem,config):
+    """
+    Method that is executed once in every worker process: it stores the problem and the
+    configuration of the parent process
+    """
+    global workerProblem, workerConfig
+    workerProblem = problem
+    workerConfig = config
+
+
+def runSeed(seed,nDestroyOps,nRepairOps,verbose=False):
+    """
+    Method that executes the ALNS with a seed in a worker process. Returns the statistics of
+    the run and the routes of the best solution as lists of nodeIDs, which are much smaller
+    to send back than the routes themselves.
+    """
+    alns = ALNS(workerProblem,nDestroyOps,nRepairOps,workerConfig.replace(randomSeed=seed))
+    starttime = time.process_time()
+    if verbose:
+        alns.execute()
+    else:
+        with open(os.devnull,"w") as devnull, contextlib.redirect_stdout(devnull):
+            alns.execute()
+    best = alns.bestSolution
+    return {"seed": seed,
+            "distance": best.distance,
+            "nRoutes": len(best.routes),
+            "nNotServed": len(best.notServed),
+            "cpuTime": time.process_time() - starttime,
+            "sequences": routeSequences(best)}
+
+
+def routeSequences(solution):
+    """
+    Method that returns the routes of a solution as lists of nodeIDs
+    """
+    return [list(route.nodeSequence()) for route in solution.routes]
+
+
+def solutionFromSequences(problem,sequences,config):
+    """
+    Method that builds the solution with the routes given as lists of nodeIDs
+    """
+    requestOf = {req.ID: req for req in problem.requests}
+    solution = Solution(problem,list(),list(),list(),config)
+    routes = []
+    for sequence in sequences:
+        locations = [problem.nodes[nodeID] for nodeID in sequence]
+        requests = [requestOf[loc.requestID] for loc in locations if loc.typeLoc == 1]
+        routes.append(solution.newRoute(locations,requests))
+    served = [req for route in routes for req in route.requests]
+    servedIDs = {req.ID for req in served}
+    notServed = [req for req in problem.requests if req.ID not in servedIDs]
+    return Solution(problem,routes,served,notServed,config)
+
+
+class MultiStartALNS:
+    """
+    Class that executes independent runs of the ALNS with different seeds in parallel
+    processes. The problem and the configuration are given to each process once, when it
+    starts; with the fork start method they are shared with the parent process instead
+    of copied. A run gives the same result as a single ALNS with the configuration with
+    randomSeed set to its seed.
+
+    Parameters
+    ----------
+    problem : PDPTW
+        The problem instance that we want to solve.
+    nDestroyOps : int
+        number of destroy operators.
+    nRepairOps : int
+        number of repair operators.
+    seeds : list of int
+        seeds of the runs, at least one
+    nWorkers : int
+        number of processes, by default the number of CPU cores
+    config : Config
+        parameters of the runs, by default the current values of Parameters
+    runs : list of dicts
+        statistics of every run (seed, distance, nRoutes, nNotServed, cpuTime), ordered by seed
+    bestSolution : Solution
+        best solution of all runs
+    bestDistance : int
+        Distance of the best solution
+    wallTime : float
+        elapsed time of all runs together in seconds
+    """
+    def __init__(self,problem,nDestroyOps,nRepairOps,seeds,nWorkers=None,config=None):
+        self.problem = problem
+        self.nDestroyOps = nDestroyOps
+        self.nRepairOps = nRepairOps
+        self.seeds = list(seeds)
+        if len(self.seeds) == 0:
+            raise Exception("At least one seed is needed for the runs of the ALNS")
+        self.nWorkers = nWorkers if nWorkers is not None else os.cpu_count()
+        self.config = config if config is not None else Config.fromParameters()
+
+    def execute(self):
+        """
+        Method that executes the runs and keeps the best solution
+        """
+        prepareProblem(self.problem,self.config)
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("fork" if "fork" in methods else None)
+        starttime = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=min(self.nWorkers,len(self.seeds)),mp_context=context,
+                                 initializer=initWorker,initargs=(self.problem,self.config)) as pool:
+            futures = [pool.submit(runSeed,seed,self.nDestroyOps,self.nRepairOps) for seed in self.seeds]
+            self.runs = [future.result() for future in futures]
+        self.wallTime = time.perf_counter() - starttime
+        best = min(self.runs,key=lambda run: run["distance"])
+        self.bestSolution = solutionFromSequences(self.problem,best["sequences"],self.config)
+        self.bestDistance = self.bestSolution.distance
+        for run in self.runs:
+            del run["sequences"]
+        print("Terminated. Best distance: "+str(self.bestDistance)+" (seed "+str(best["seed"])+"), wall time: "+str(round(self.wallTime,1))+" seconds")
+
+    def printRuns(self):
+        """
+        Method that prints the statistics of every run
+        """
+        for run in self.runs:
+            adopted = f", {run['nAdopted']} adopted" if "nAdopted" in run else ""
+            print(f"seed {run['seed']:3d}: distance {run['distance']:.2f}, {run['nRoutes']} routes, {run['nNotServed']} not served{adopted}, {run['cpuTime']:.1f} CPU seconds")
+        cpuTime = sum(run["cpuTime"] for run in self.runs)
+        print(f"CPU time of the runs {cpuTime:.1f} seconds, wall time {self.wallTime:.1f} seconds, speedup {cpuTime/self.wallTime:.2f}")
+
+
+def receiveSolution(inbox):
+    """
+    Method that waits for the solution of the previous island. Raises an exception if the
+    main process is gone, such that the island does not wait forever.
+    """
+    parent = multiprocessing.parent_process()
+    while True:
+        try:
+            return inbox.get(timeout=1)
+        except queue.Empty:
+            if parent is not None and not parent.is_alive():
+                raise Exception("The main process of the islands stopped")
+
+
+def runIsland(problem,config,seed,nDestroyOps,nRepairOps,inbox,outbox,results):
+    """
+    Method that executes the ALNS of an island in its own process. Every 
+    config.migrationInterval iterations, the island sends its best solution to the next
+    island (outbox) and waits for the best solution of the previous island (inbox), which 
+    replaces its current solution if it is better. All islands exchange after the same
+    iterations, so a run is reproducible. For the same reason an island always executes 
+    config.nIterations iterations, config.timeBudget and config.stallIterations are not used.
+    If the island fails, the traceback is put on the results queue as "error".
+    """
+    try:
+        config = config.replace(randomSeed=seed,timeBudget=None,stallIterations=None)
+        alns = ALNS(problem,nDestroyOps,nRepairOps,config)
+        starttime = time.process_time()
+        nAdopted = 0
+        with open(os.devnull,"w") as devnull, contextlib.redirect_stdout(devnull):
+            alns.constructInitialSolution()
+            for i in range(config.nIterations):
+                alns.iterate(i)
+                if (i+1) % config.migrationInterval == 0 and i+1 < config.nIterations:
+                    outbox.put(routeSequences(alns.bestSolution))
+                    if alns.adoptSolution(solutionFromSequences(problem,receiveSolution(inbox),config)):
+                        nAdopted += 1
+        best = alns.bestSolution
+        results.put({"seed": seed,
+                     "distance": best.distance,
+                     "nRoutes": len(best.routes),
+                     "nNotServed": len(best.notServed),
+                     "nAdopted": nAdopted,
+                     "cpuTime": time.process_time() - starttime,
+                     "sequences": routeSequences(best)})
+    except Exception:
+        #the traceback is sent as text, since not every exception can be pickled
+        results.put({"seed": seed, "error": traceback.format_exc()})
+
+
+class IslandALNS(MultiStartALNS):
+    """
+    Class that executes the ALNS on islands: one process per seed, each with its own 
+    operator weights and temperature. The islands form a ring, every 
+    config.migrationInterval iterations each island sends its best solution to the
+    next one through a queue, and adopts the solution it receives if that is better than
+    its current solution (ALNS.adoptSolution).
+
+    Every island needs its own process, so nWorkers is not used. The runs have the
+    attributes of MultiStartALNS, with the number of adopted solutions (nAdopted) in the
+    statistics of every island. If an island fails or its process dies, the other islands
+    are stopped and execute raises an exception.
+    """
+    def execute(self):
+        """
+        Method that executes the islands and keeps the best solution
+        """
+        prepareProblem(self.problem,self.config)
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("fork" if "fork" in methods else None)
+        starttime = time.perf_counter()
+        queues = [context.Queue() for seed in self.seeds]
+        results = context.Queue()
+        processes = []
+        for k, seed in enumerate(self.seeds):
+            #island k receives from island k-1 and sends to island k+1
+            outbox = queues[(k+1) % len(self.seeds)]
+            process = context.Process(target=runIsland,args=(self.problem,self.config,seed,self.nDestroyOps,self.nRepairOps,queues[k],outbox,results))
+            process.start()
+            processes.append(process)
+        try:
+            self.runs = sorted(self.collectRuns(processes,results),key=lambda run: self.seeds.index(run["seed"]))
+        except BaseException:
+            #the other islands wait for the failed one, they are stopped
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+            raise
+        finally:
+            for process in processes:
+                process.join()
+        self.wallTime = time.perf_counter() - starttime
+        best = min(self.runs,key=lambda run: run["distance"])
+        self.bestSolution = solutionFromSequences(self.problem,best["sequences"],self.config)
+        self.bestDistance = self.bestSolution.distance
+        for run in self.runs:
+            del run["sequences"]
+        print("Terminated. Best distance: "+str(self.bestDistance)+" (island with seed "+str(best["seed"])+"), wall time: "+str(round(self.wallTime,1))+" seconds")
+
+    def collectRuns(self,processes,results):
+        """
+        Method that returns the results of the islands. Raises an exception if an island 
+        reports an error, or if a process ends without a result.
+        """
+        runs = []
+        while len(runs) < len(processes):
+            try:
+                run = results.get(timeout=1)
+            except queue.Empty:
+                failed = [process for process in processes if process.exitcode not in (None,0)]
+                if len(failed) > 0:
+                    raise Exception(f"An island process stopped with exit code {failed[0].exitcode}")
+                continue
+            if "error" in run:
+                raise Exception(f"The island with seed {run['seed']} failed:\n{run['error']}")
+            runs.append(run)
+        return runs
+
+
+def initCandidateWorker(problem,config,nDestroyOps,nRepairOps):
+    """
+    Method that is executed once in every process of a CandidatePool, it creates the ALNS
+    whose operators generate the candidates
+    """
+    global workerALNS
+    initWorker(problem,config)
+    workerALNS = ALNS(problem,nDestroyOps,nRepairOps,config)
+
+
+def generateCandidate(sequences,seed,destroyOpsWeigths,repairOpsWeigths,alns=None):
+    """
+    Method that generates a candidate solution from the solution with the routes given as
+    lists of nodeIDs: the neighbourhood size and operators are drawn with the weights, and
+    the destroy and repair are executed, all with a random generator with the given seed.
+    The ALNS of the worker process is used if alns is None.
+    """
+    if alns is None:
+        alns = workerALNS
+    alns.randomGen = random.Random(seed)
+    alns.destroyOpsWeigths = list(destroyOpsWeigths)
+    alns.repairOpsWeigths = list(repairOpsWeigths)
+    alns.tempSolution = solutionFromSequences(alns.problem,sequences,alns.config)
+    sizeNBH, destroyOpNr, repairOpNr = alns.determineMove()
+    alns.destroyAndRepair(destroyOpNr,repairOpNr,sizeNBH)
+    return {"distance": alns.tempSolution.distance,
+            "sizeNBH": sizeNBH,
+            "destroyOpNr": destroyOpNr,
+            "repairOpNr": repairOpNr,
+            "sequences": routeSequences(alns.tempSolution)}
+
+
+class CandidatePool:
+    """
+    Class that generates candidate solutions for ALNS.iterateCandidates in a pool of processes.
+    Every candidate starts from the routes of the current solution and only depends on its seed,
+    so the candidates do not depend on the number of processes. With nWorkers equal to 0 the
+    candidates are generated one after the other in the calling process.
+
+    Parameters
+    ----------
+    problem : PDPTW
+        The problem instance that we want to solve.
+    nDestroyOps : int
+        number of destroy operators.
+    nRepairOps : int
+        number of repair operators.
+    config : Config
+        parameters of the ALNS
+    nWorkers : int
+        number of processes, by default the number of CPU cores
+    """
+    def __init__(self,problem,nDestroyOps,nRepairOps,config,nWorkers=None):
+        self.problem = problem
+        self.config = config
+        self.nWorkers = nWorkers if nWorkers is not None else os.cpu_count()
+        self.pool = None
+        self.alns = None
+        if self.nWorkers > 0:
+            prepareProblem(problem,config)
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("fork" if "fork" in methods else None)
+            self.pool = ProcessPoolExecutor(max_workers=self.nWorkers,mp_context=context,initializer=initCandidateWorker,
+                                            initargs=(problem,config,nDestroyOps,nRepairOps))
+        else:
+            self.alns = ALNS(problem,nDestroyOps,nRepairOps,config)
+
+    def generate(self,solution,seeds,destroyOpsWeigths,repairOpsWeigths):
+        """
+        Method that generates one candidate from the solution for every seed. Returns a list
+        of dicts with the distance, neighbourhood size, operators and routes (lists of nodeIDs)
+        of every candidate, in the order of the seeds.
+        """
+        sequences = routeSequences(solution)
+        if self.pool is None:
+            return [generateCandidate(sequences,seed,destroyOpsWeigths,repairOpsWeigths,self.alns) for seed in seeds]
+        futures = [self.pool.submit(generateCandidate,sequences,seed,destroyOpsWeigths,repairOpsWeigths) for seed in seeds]
+        return [future.result() for future in futures]
+
+    def solution(self,candidate):
+        """
+        Method that builds the solution of a candidate
+        """
+        return solutionFromSequences(self.problem,candidate["sequences"],self.config)
+
+    def close(self):
+        """
+        Method that stops the processes
+        """
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+
+if __name__ == "__main__":
+    fileName = sys.argv[1] if len(sys.argv) > 1 else "Instances/lc102.txt"
+    nSeeds = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    nWorkers = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    islands = len(sys.argv) > 4 and sys.argv[4] == "islands"
+    config = Config.fromParameters()
+    problem = PDPTW.readInstance(fileName,config)
+    print(problem)
+    multiStart = (IslandALNS if islands else MultiStartALNS)(problem,4,3,range(1,nSeeds+1),nWorkers,config)
+    multiStart.execute()
+    multiStart.printRuns()
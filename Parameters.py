@@ -5,14 +5,21 @@ class Parameters:
     """
     
     maketwoOpt = False
+    twoOptOnAccept = False # apply 2-opt to the changed routes of every accepted solution
+    localSearch = False # apply relocate, exchange and 2-opt* (LocalSearch) to new global bests
     
 
     nIterations = 80  #number of iterations of the ALNS
+    timeBudget = None #seconds of wall-clock time of a run, the ALNS then iterates until the time is up and cools by the fraction of the time used; None to run nIterations iterations
+    stallIterations = None #stop after this many iterations without a new global best, None to disable
     
     minSizeNBH = 10      #minimum neighborhood size CALIBRATED
     maxSizeNBH = 45     #maximum neighborhood size CALIBRATED
     
     randomSeed = 1      #value of the random seed
+    nCandidates = 1 #number of candidate solutions generated from the current solution in every iteration (ALNS.iterateCandidates)
+    candidateWorkers = None #processes that generate the candidates, None for the number of CPU cores, 0 to generate them in the ALNS process
+    migrationInterval = 20 #iterations between the exchanges of best solutions in the island model (ParallelALNS.IslandALNS)
     reward = {
         "Global Best": 10,
         "Better Sol": 8,
@@ -26,13 +33,38 @@ class Parameters:
     coolingRate = 0.7 #     updateSpeed = 0.8 # For adaptive
 
     useBattery = True
+    tightenTimeWindows = True # solve the reduced problem with tightened time windows, see PDPTW.reduce
+
+    # Store parsed instances as .npz files, keyed by the hash of the instance file
+    useInstanceCache = True
+    instanceCacheDir = "cache/instances"
     # ------------------------- #
 
     p = 5 # Calibrated
     Regretk = 2 # Calibrated
 
+    # Store routes as arrays of nodeIDs (CompactRoute), which uses less memory
+    compactRoutes = False
+
+    # Number of routes of which the feasibility and distance are cached (PDPTW.evaluateRoute), 0 to disable
+    routeCacheSize = 1000
+
+    # Check the distances that are updated incrementally against a full recomputation (slow, for debugging)
+    checkDistances = False
+
+    # Evaluate all insertion positions of a route at once with numpy,
+    # only pays off for routes with at least vectorizeMinLength locations
+    vectorizedInsertion = True
+    vectorizeMinLength = 16
+
+    # Only evaluate insertions and local search moves that use one of the k shortest
+    # compatible arcs of a location (granular neighbourhood), None to evaluate all of them
+    granularity = None
+
     # For shaw removal
     alpha = 0.25 # Calibrated
+    fullShaw = False # use the relatedness of Ropke and Pisinger with time windows
+    shawWeights = (9, 3, 2) # weights of distance, time and demand if fullShaw
 
     # To override operators:
     overrideOpr = False
@@ -7,6 +7,13 @@ Created on Tue Jul 26 12:41:37 2022
 
 import numpy as np
 import math  
+import hashlib
+import functools
+import io
+import os
+import sys
+from collections import OrderedDict
+from Config import Config
 
 class Request:
     """
@@ -22,6 +29,8 @@ class Request:
         id of request.
 
     """
+    __slots__ = ("pickUpLoc","deliveryLoc","ID")
+    
     def __init__(self,pickUpLoc,deliveryLoc,ID):
        
         self.pickUpLoc = pickUpLoc
@@ -53,6 +62,8 @@ class Location:
     nodeID : int
         id of the node, used for the distance matrix
     """
+    __slots__ = ("requestID","xLoc","yLoc","demand","startTW","endTW","servTime","typeLoc","nodeID")
+    
     def __init__(self,requestID,xLoc,yLoc,demand,startTW,endTW,servTime,typeLoc,nodeID):
 
         self.requestID = requestID
@@ -93,13 +104,31 @@ class PDPTW:
         the depot where all vehicles must start and end.
     locations : Set of Locations
         The set containing all locations
+    nodes : List of Locations
+        all locations, indexed by nodeID
+    xLoc, yLoc, demand, startTW, endTW, servTime, typeLoc, requestID : arrays
+        attributes of the locations, indexed by nodeID
      distMatrix : 2D array
          matrix with all distances between cities
+    distances : List of Lists
+        the distance matrix as nested lists
+    compatible : 2D array of booleans
+        compatible[i,j] is True if node j can be visited directly after node i
+    compatibleArcs : List of Lists
+        compatibility matrix as nested lists
+    compatibleDistances : 2D array of floats
+        distMatrix with an infinite distance for the incompatible arcs
+    routeCache : OrderedDict
+        feasibility and distance of recently evaluated routes, in order of last use
+    originalStartTW, originalEndTW : arrays
+        time windows before they were tightened by reduce, None if they were not tightened
     capacity : int
         capacity of the vehicles
     
     """     
-    def __init__(self,name,requests,depot,vehicleCapacity, vehicleBattery):
+    compiledVersion = 1 #increase when the format of the compiled instances changes
+    
+    def __init__(self,name,requests,depot,vehicleCapacity, vehicleBattery, distMatrix=None):
         self.name = name
         self.requests = requests
         self.depot = depot
@@ -112,30 +141,274 @@ class PDPTW:
             self.locations.add(r.pickUpLoc)
             self.locations.add(r.deliveryLoc)
 
-        #compute the distance matrix
-        self.distMatrix = np.zeros((len(self.locations),len(self.locations))) #init as nxn matrix
-        for i in self.locations:
-            for j in self.locations:
-                distItoJ = Location.getDistance(i,j)
-                self.distMatrix[i.nodeID,j.nodeID] = distItoJ
+        #list with all locations, indexed by nodeID
+        self.nodes = sorted(self.locations,key=lambda loc: loc.nodeID)
+        #attributes of the locations as arrays indexed by nodeID
+        self.xLoc = np.array([loc.xLoc for loc in self.nodes],dtype=float)
+        self.yLoc = np.array([loc.yLoc for loc in self.nodes],dtype=float)
+        self.demand = np.array([loc.demand for loc in self.nodes],dtype=float)
+        self.startTW = np.array([loc.startTW for loc in self.nodes],dtype=float)
+        self.endTW = np.array([loc.endTW for loc in self.nodes],dtype=float)
+        self.servTime = np.array([loc.servTime for loc in self.nodes],dtype=float)
+        self.typeLoc = np.array([loc.typeLoc for loc in self.nodes],dtype=int)
+        self.requestID = np.array([loc.requestID for loc in self.nodes],dtype=int)
+
+        #compute the distance matrix from the coordinates, as nxn matrix, unless it is given
+        if distMatrix is None:
+            dx = self.xLoc[:,None] - self.xLoc[None,:]
+            dy = self.yLoc[:,None] - self.yLoc[None,:]
+            distMatrix = np.sqrt(dx**2+dy**2)
+        self.distMatrix = distMatrix
         self.distMatrix_Max = np.max(self.distMatrix)
         self.distMatrix_Min = np.min(self.distMatrix)
+        #relatedness matrices for Shaw removal, per setting of the weights
+        self.relatedness = dict()
+        #granular arcs, per number of neighbours
+        self.granularArcs = dict()
+        #least recently used cache of evaluated routes
+        self.routeCache = OrderedDict()
+        self.routeCacheHits = 0
+        self.routeCacheMisses = 0
+        #original time windows of a reduced problem, see reduce
+        self.originalStartTW = None
+        self.originalEndTW = None
+
+    #the matrices below are created when they are first used, so loading an instance does not pay for them
+    @functools.cached_property
+    def distances(self):
+        """
+        The distance matrix as nested lists, these are faster to look up one at a time
+        """
+        return self.distMatrix.tolist()
+
+    @functools.cached_property
+    def compatible(self):
+        """
+        The compatibility matrix, see computeCompatibility
+        """
+        return self.computeCompatibility()
+
+    @functools.cached_property
+    def compatibleArcs(self):
+        """
+        The compatibility matrix as nested lists, used by the insertion of Route.bestInsertion
+        """
+        return self.compatible.tolist()
+
+    @functools.cached_property
+    def compatibleDistances(self):
+        """
+        The distances with incompatible arcs infinitely long, used by Route.bestInsertionVectorized
+        """
+        return np.where(self.compatible,self.distMatrix,np.inf)
+    
+    def computeCompatibility(self):
+        """
+        Method that returns the compatibility matrix: node j can follow node i if 
+            - the vehicle can leave i at its earliest and reach j before the end of its time window
+            - the load between i and j fits in the vehicle: if i is a pickup or j is a delivery 
+              of another request, both requests are in the vehicle
+            - j is not the pickup of the request that is delivered at i
+        The time window of the final depot is not checked, so every node can be followed
+        by the depot.
+        """
+        depotID = self.depot.nodeID
+        compatible = self.startTW[:,None] + self.servTime[:,None] + self.distMatrix <= self.endTW[None,:]
+        bothInVehicle = (self.typeLoc[:,None] == 1) | (self.typeLoc[None,:] == -1)
+        sameRequest = self.requestID[:,None] == self.requestID[None,:]
+        overloaded = np.abs(self.demand[:,None]) + np.abs(self.demand[None,:]) > self.capacity
+        compatible &= ~(bothInVehicle & ~sameRequest & overloaded)
+        compatible &= ~(sameRequest & (self.typeLoc[:,None] == -1) & (self.typeLoc[None,:] == 1))
+        compatible[:,depotID] = True
+        np.fill_diagonal(compatible,False)
+        return compatible
+    
+    def reduce(self):
+        """
+        Method that returns a reduced view of the problem, in which the time windows are tightened:
+            - a location cannot be reached before the travel time from the depot
+            - a delivery cannot be reached before its pickup is served and the travel time between them
+            - a pickup should be left in time to reach its delivery before the end of its time window
+        These bounds hold for every route, so the feasible routes are the same, but infeasible 
+        insertions are rejected earlier and more arcs are incompatible. The depot cannot 
+        tighten the end of the time windows, because the time window of the final depot is not checked.
+        
+        The original time windows are kept in originalStartTW and originalEndTW.
+        """
+        dist = self.distMatrix
+        depot = self.depot
+        requests = list()
+        for req in self.requests:
+            p = req.pickUpLoc
+            d = req.deliveryLoc
+            pTravel = dist[p.nodeID,d.nodeID]
+            pStart = max(p.startTW, depot.servTime + dist[depot.nodeID,p.nodeID])
+            pEnd = min(p.endTW, d.endTW - p.servTime - pTravel)
+            dStart = max(d.startTW, depot.servTime + dist[depot.nodeID,d.nodeID], pStart + p.servTime + pTravel)
+            pickUpLoc = Location(p.requestID,p.xLoc,p.yLoc,p.demand,pStart,pEnd,p.servTime,p.typeLoc,p.nodeID)
+            deliveryLoc = Location(d.requestID,d.xLoc,d.yLoc,d.demand,dStart,d.endTW,d.servTime,d.typeLoc,d.nodeID)
+            requests.append(Request(pickUpLoc,deliveryLoc,req.ID))
+        reduced = PDPTW(self.name,requests,depot,self.capacity,self.battery,self.distMatrix)
+        reduced.originalStartTW = self.startTW
+        reduced.originalEndTW = self.endTW
+        return reduced
+    
+    def getGranularArcs(self,k):
+        """
+        Method that returns the granular arcs as nested lists of booleans indexed by nodeID.
+        Arc (i,j) is granular if it is compatible, and j is one of the k nearest compatible
+        successors of i or i is one of the k nearest compatible predecessors of j. 
+        Arcs from and to the depot are always granular. The arcs are computed once for each k.
+        
+        Returns the arcs as a 2D array and as nested lists, which are faster to look up one at a time.
+        """
+        if k not in self.granularArcs:
+            compatible = self.compatible
+            n = len(self.nodes)
+            nNeighbours = min(k,n-1)
+            dist = np.where(compatible,self.distMatrix,np.inf)
+            granular = np.zeros((n,n),dtype=bool)
+            successors = np.argpartition(dist,nNeighbours-1,axis=1)[:,:nNeighbours]
+            granular[np.repeat(np.arange(n),nNeighbours),successors.ravel()] = True
+            predecessors = np.argpartition(dist,nNeighbours-1,axis=0)[:nNeighbours,:]
+            granular[predecessors.ravel(),np.tile(np.arange(n),nNeighbours)] = True
+            #with fewer than k compatible neighbours, incompatible ones are selected as well
+            granular &= compatible
+            granular[self.depot.nodeID,:] = True
+            granular[:,self.depot.nodeID] = True
+            self.granularArcs[k] = (granular,granular.tolist())
+        return self.granularArcs[k]
+
+    def getRelatedness(self,alpha,fullShaw=False,weights=(9,3,2)):
+        """
+        Method that returns the relatedness between all pairs of requests as a matrix 
+        indexed by request ID. It only depends on the instance and the weights, 
+        so it is computed once for each setting.
+
+        Parameters
+        ----------
+        alpha : float
+            weight of the distance, the demand gets weight 1-alpha.
+        fullShaw : boolean
+            if True, use the relatedness of Ropke and Pisinger (2006) with distance, 
+            time and demand terms, each normalized to [0,1]. The start of the time 
+            windows is used instead of the visit times, so it does not depend on a solution.
+        weights : tuple
+            weights of the distance, time and demand terms when fullShaw is True.
+        """
+        key = (alpha,fullShaw,tuple(weights))
+        if key not in self.relatedness:
+            nIDs = max(req.ID for req in self.requests)+1
+            pickUps = np.zeros(nIDs,dtype=int)
+            deliveries = np.zeros(nIDs,dtype=int)
+            demand = np.zeros(nIDs)
+            pickUpTime = np.zeros(nIDs)
+            deliveryTime = np.zeros(nIDs)
+            for req in self.requests:
+                pickUps[req.ID] = req.pickUpLoc.nodeID
+                deliveries[req.ID] = req.deliveryLoc.nodeID
+                demand[req.ID] = req.pickUpLoc.demand
+                pickUpTime[req.ID] = req.pickUpLoc.startTW
+                deliveryTime[req.ID] = req.deliveryLoc.startTW
+            distance = self.distMatrix[pickUps[:,None],pickUps[None,:]] + self.distMatrix[deliveries[:,None],deliveries[None,:]]
+            demandDiff = np.abs(demand[:,None] - demand[None,:])
+            if fullShaw:
+                timeDiff = np.abs(pickUpTime[:,None] - pickUpTime[None,:]) + np.abs(deliveryTime[:,None] - deliveryTime[None,:])
+                phi, chi, psi = weights
+                R = phi*(distance / max(np.max(distance),1)) + chi*(timeDiff / max(np.max(timeDiff),1)) + psi*(demandDiff / max(np.max(demandDiff),1))
+            else:
+                R = alpha*(distance / self.distMatrix_Max) + (1-alpha)*(demandDiff / self.capacity)
+            self.relatedness[key] = R
+        return self.relatedness[key]
+
+    def evaluateRoute(self,route):
+        """
+        Method that returns the feasibility and distance of a route. If routeCacheSize in the
+        configuration of the route is positive, they are looked up by the sequence of nodeIDs 
+        of the route, and only evaluated if the sequence is not in the cache. The least recently
+        used sequence is removed when the cache is full. Runs in threads with different 
+        configurations can share the cache, useBattery is part of the key.
+        """
+        config = route.config
+        if config.routeCacheSize <= 0:
+            return route.evaluate()
+        key = (config.useBattery,tuple(route.nodeSequence()))
+        result = self.routeCache.get(key)
+        if result is not None:
+            self.routeCacheHits += 1
+            try:
+                self.routeCache.move_to_end(key)
+            except KeyError: #removed by another thread in the meantime
+                pass
+            return result
+        self.routeCacheMisses += 1
+        result = route.evaluate()
+        self.routeCache[key] = result
+        while len(self.routeCache) > config.routeCacheSize:
+            try:
+                self.routeCache.popitem(last=False)
+            except KeyError: #emptied by another thread in the meantime
+                break
+        return result
+    
+    def routeCacheInfo(self):
+        """
+        Method that returns the number of hits and misses, the hit rate, the number of entries 
+        and the approximate memory in bytes of the route cache
+        """
+        lookups = self.routeCacheHits + self.routeCacheMisses
+        memory = sys.getsizeof(self.routeCache)
+        for key, result in self.routeCache.items():
+            memory += sys.getsizeof(key) + sys.getsizeof(key[1]) + sys.getsizeof(result)
+        return {"hits": self.routeCacheHits,
+                "misses": self.routeCacheMisses,
+                "hitRate": self.routeCacheHits / lookups if lookups > 0 else 0,
+                "entries": len(self.routeCache),
+                "memory": memory}
 
     def __str__(self):
         return f" PDPTW problem {self.name} with {len(self.requests)} requests and a vehicle capacity of {self.capacity}"
 
     
-    def readInstance(fileName):
+    def readInstance(fileName,config=None):
         """
-        Method that reads an instance from a file and returns the instancesf
+        Method that reads an instance from a file and returns the instance. The values of
+        the configuration below are taken from config, by default from Parameters.
+        
+        If useInstanceCache is True, the parsed instance is compiled to an .npz file in 
+        instanceCacheDir, named after the hash of the file content. Later reads of the 
+        same content load the compiled file instead of parsing.
+        
+        If tightenTimeWindows is True, the reduced problem is returned, see reduce.
+        """
+        if config is None:
+            config = Config.fromParameters()
+        with open(fileName,"rb") as f:
+            content = f.read()
+        if not config.useInstanceCache:
+            problem = PDPTW.parseInstance(fileName,content)
+        else:
+            cacheFile = PDPTW.compiledFileName(content,config.instanceCacheDir)
+            if os.path.exists(cacheFile):
+                problem = PDPTW.loadCompiled(fileName,cacheFile)
+            else:
+                problem = PDPTW.parseInstance(fileName,content)
+                problem.saveCompiled(cacheFile)
+        if config.tightenTimeWindows:
+            problem = problem.reduce()
+        return problem
+        
+    def parseInstance(fileName,content):
         """
-        f = open(fileName)
+        Method that parses the content of an instance file and returns the instance
+        """
+        lines = io.TextIOWrapper(io.BytesIO(content)).readlines()
         requests = list()
         unmatchedPickups = dict()
         unmatchedDeliveries = dict()
         nodeCount = 0
         requestCount = 1
-        for line in f.readlines()[1:-6]:            
+        for line in lines[1:-6]:            
             asList = []
             n  = 13 #columns start every 13 characters
             for index in range(0, len(line), n):
@@ -189,14 +462,62 @@ class PDPTW:
             raise Exception("Not all matched")
         
         # read the vehicle capacity 
-        f = open(fileName)
-        print("helo")
-        print(f)
-        capLine = f.readlines()[-4]
+        capLine = lines[-4]
         capacity = int(capLine[-7:-3].strip())
         
-        f = open(fileName)
-        batLine = f.readlines()[-5]
+        batLine = lines[-5]
         battery = float(batLine[-7:-1].strip())
-        print(battery)
         return PDPTW(fileName,requests,depot,capacity, battery)
+    
+    def compiledFileName(content,cacheDir=None):
+        """
+        Method that returns the name of the compiled file for the content of an instance file,
+        in cacheDir (by default Parameters.instanceCacheDir)
+        """
+        if cacheDir is None:
+            cacheDir = Config.fromParameters().instanceCacheDir
+        digest = hashlib.sha1(content).hexdigest()
+        return os.path.join(cacheDir,f"{digest}_v{PDPTW.compiledVersion}.npz")
+    
+    def saveCompiled(self,cacheFile):
+        """
+        Method that stores the parsed instance and its distance matrix in an .npz file. 
+        The attributes of the locations are stored as integers, as in the instance files,
+        so a reduced problem (with tightened time windows) can not be stored.
+        """
+        if self.originalStartTW is not None:
+            raise Exception("A reduced problem can not be compiled, its time windows are not integers")
+        os.makedirs(os.path.dirname(cacheFile),exist_ok=True)
+        #node attributes as columns, in the order of the Location constructor
+        nodes = np.array([[loc.requestID,loc.xLoc,loc.yLoc,loc.demand,loc.startTW,loc.endTW,loc.servTime,loc.typeLoc,loc.nodeID] for loc in self.nodes],dtype=np.int64)
+        requests = np.array([[req.pickUpLoc.nodeID,req.deliveryLoc.nodeID,req.ID] for req in self.requests],dtype=np.int64).reshape(-1,3)
+        #write to a temporary file first, so an interrupted write never leaves a broken cache file
+        tempFile = cacheFile + f".{os.getpid()}.tmp.npz"
+        np.savez(tempFile,nodes=nodes,requests=requests,depot=self.depot.nodeID,
+                 capacity=self.capacity,battery=self.battery,distMatrix=self.distMatrix)
+        os.replace(tempFile,cacheFile)
+        
+    def loadCompiled(fileName,cacheFile):
+        """
+        Method that returns the instance stored in a compiled .npz file
+        """
+        with np.load(cacheFile) as data:
+            locations = [Location(*row) for row in data["nodes"].tolist()]
+            requests = [Request(locations[p],locations[d],ID) for p, d, ID in data["requests"].tolist()]
+            depot = locations[int(data["depot"])]
+            capacity = int(data["capacity"])
+            battery = float(data["battery"])
+            distMatrix = data["distMatrix"]
+        return PDPTW(fileName,requests,depot,capacity,battery,distMatrix)
+    
+    def precompileInstances(instanceDir="Instances"):
+        """
+        Method that compiles all instance files in a directory to the instance cache
+        """
+        for instanceFile in sorted(os.listdir(instanceDir)):
+            with open(os.path.join(instanceDir,instanceFile),"rb") as file:
+                content = file.read()
+            cacheFile = PDPTW.compiledFileName(content)
+            if not os.path.exists(cacheFile):
+                PDPTW.parseInstance(os.path.join(instanceDir,instanceFile),content).saveCompiled(cacheFile)
+            print(f"{instanceFile} -> {cacheFile}")
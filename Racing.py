@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+"""
+Calibrates parameters of the ALNS with iterated racing (as in irace): configurations are
+evaluated instance by instance, and configurations that are significantly worse by a
+Friedman test are discarded early.
+Usage: python Racing.py [budget in runs] [number of processes]
+"""
+import os
+import sys
+import math
+import random
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from ExperimentHarness import runCell, storedCells, storeRow
+from ResultStore import ResultStore
+from Config import Config
+
+
+def gammaQ(a,x):
+    """
+    Method that returns the regularized upper incomplete gamma function Q(a,x), with a series
+    for x < a+1 and a continued fraction otherwise (Numerical Recipes, 6.2)
+    """
+    if x <= 0:
+        return 1.0
+    logPrefix = a*math.log(x) - x - math.lgamma(a)
+    if x < a+1:
+        term = total = 1.0/a
+        n = a
+        while abs(term) > abs(total)*1e-15:
+            n += 1
+            term *= x/n
+            total += term
+        return 1.0 - total*math.exp(logPrefix)
+    tiny = 1e-300
+    b = x + 1 - a
+    c = 1/tiny
+    d = 1/b
+    h = d
+    for i in range(1,1000):
+        an = -i*(i-a)
+        b += 2
+        d = an*d + b
+        d = tiny if abs(d) < tiny else d
+        c = b + an/c
+        c = tiny if abs(c) < tiny else c
+        d = 1/d
+        h *= d*c
+        if abs(d*c-1) < 1e-15:
+            break
+    return math.exp(logPrefix)*h
+
+
+def chi2Survival(x,df):
+    """
+    Method that returns P(X > x) for a chi-squared distributed X with df degrees of freedom
+    """
+    return gammaQ(df/2,x/2)
+
+
+def betaI(a,b,x):
+    """
+    Method that returns the regularized incomplete beta function I_x(a,b), with a continued
+    fraction (Numerical Recipes, 6.4)
+    """
+    if x <= 0:
+        return 0.0
+    if x >= 1:
+        return 1.0
+    if x > (a+1)/(a+b+2):
+        return 1.0 - betaI(b,a,1-x)
+    logPrefix = math.lgamma(a+b) - math.lgamma(a) - math.lgamma(b) + a*math.log(x) + b*math.log(1-x)
+    tiny = 1e-300
+    c = 1.0
+    d = 1 - (a+b)*x/(a+1)
+    d = 1/(tiny if abs(d) < tiny else d)
+    h = d
+    for m in range(1,1000):
+        #even and odd step of the continued fraction
+        for an in (m*(b-m)*x/((a+2*m-1)*(a+2*m)), -(a+m)*(a+b+m)*x/((a+2*m)*(a+2*m+1))):
+            d = 1 + an*d
+            d = 1/(tiny if abs(d) < tiny else d)
+            c = 1 + an/c
+            c = tiny if abs(c) < tiny else c
+            h *= d*c
+        if abs(d*c-1) < 1e-15:
+            break
+    return math.exp(logPrefix)*h/a
+
+
+def tQuantile(p,df):
+    """
+    Method that returns the p-quantile (p >= 0.5) of the Student t distribution with df degrees
+    of freedom, by bisection on its distribution function
+    """
+    def cdf(t):
+        return 1 - 0.5*betaI(df/2,0.5,df/(df+t*t))
+    low, high = 0.0, 1.0
+    while cdf(high) < p:
+        high *= 2
+    for i in range(100):
+        middle = (low+high)/2
+        if cdf(middle) < p:
+            low = middle
+        else:
+            high = middle
+    return (low+high)/2
+
+
+def ranks(values):
+    """
+    Method that returns the ranks of the values (1 is the smallest), ties get their average rank
+    """
+    order = sorted(range(len(values)),key=lambda j: values[j])
+    result = [0.0]*len(values)
+    start = 0
+    while start < len(order):
+        end = start
+        while end+1 < len(order) and values[order[end+1]] == values[order[start]]:
+            end += 1
+        for k in range(start,end+1):
+            result[order[k]] = (start+end)/2 + 1
+        start = end+1
+    return result
+
+
+def friedmanSurvivors(results,confidence):
+    """
+    Method that applies the Friedman test to a matrix of results (a row per instance, a column
+    per configuration, smaller is better). If the configurations differ significantly, the
+    configurations whose rank sum is worse than that of the best configuration by more than
+    the critical difference of the post-hoc test of Conover are discarded (as in irace).
+    Returns the indices of the surviving configurations.
+    """
+    n = len(results)
+    k = len(results[0])
+    rowRanks = [ranks(row) for row in results]
+    R = [sum(row[j] for row in rowRanks) for j in range(k)]
+    A = sum(r*r for row in rowRanks for r in row)
+    C = n*k*(k+1)**2/4
+    if A - C <= 1e-12:
+        #all configurations have the same result on every instance
+        return list(range(k))
+    T = (k-1)*sum((Rj - n*(k+1)/2)**2 for Rj in R)/(A - C)
+    if chi2Survival(T,k-1) >= 1 - confidence:
+        return list(range(k))
+    t = tQuantile(1 - (1-confidence)/2,(n-1)*(k-1))
+    critical = t*math.sqrt(2*(n*A - sum(Rj*Rj for Rj in R))/((n-1)*(k-1)))
+    best = min(R)
+    return [j for j in range(k) if R[j] - best < critical]
+
+
+class Racing:
+    """
+    Class that calibrates parameters of the ALNS with iterated racing. Every race starts with
+    the elite configurations of the previous race and new configurations, sampled around the
+    elites with a spread that decreases from race to race. The configurations are evaluated on
+    the blocks (instance, seed) one after the other, and from firstTest blocks on the Friedman
+    test discards the configurations that are significantly worse (friedmanSurvivors). A race
+    stops when its budget is used, all blocks are evaluated, or only nElites configurations
+    are left. Results are kept, so elites are not run again on the same blocks, and runs that
+    are in the ResultStore (e.g. of an earlier calibration) are not executed at all; they do not
+    count for the budget.
+
+    Parameters
+    ----------
+    space : dict
+        maps the names of Config attributes to the ordered lists of values that are tried
+    instances : list of str
+        files of the instances
+    seeds : list of int
+        seeds of the ALNS, every instance is run with every seed
+    budget : int
+        maximal number of runs of the ALNS
+    nWorkers : int
+        number of processes, by default the number of CPU cores, 0 to run in this process
+    config : Config
+        configuration of the attributes that are not calibrated, by default Parameters
+    constraint : function
+        returns False for dicts of values that are not allowed, e.g. minSizeNBH > maxSizeNBH
+    firstTest : int
+        number of blocks that are evaluated before the first test
+    confidence : float
+        confidence level of the tests
+    nElites : int
+        number of configurations that are kept after a race
+    randomSeed : int
+        seed for sampling the configurations and the order of the blocks
+    elites : list of dicts
+        the best configurations at the end, with their values, mean rank, mean distance of
+        the feasible solutions and number of infeasible solutions
+    storeFile : str
+        database of the ResultStore in which the runs are looked up and stored, None to 
+        execute every run
+    nRuns : int
+        number of runs of the ALNS
+    cpuTime : float
+        total CPU time of the runs
+    nStored : int
+        number of runs that were taken from the store
+    storedTime : float
+        CPU time of the runs that were taken from the store, when they were executed
+    """
+    def __init__(self,space,instances,seeds,budget,nWorkers=None,config=None,constraint=None,
+                 firstTest=5,confidence=0.95,nElites=3,randomSeed=1,nDestroyOps=4,nRepairOps=3,
+                 storeFile="cache/results.sqlite"):
+        self.space = {name: list(values) for name, values in space.items()}
+        self.budget = budget
+        self.nWorkers = nWorkers if nWorkers is not None else os.cpu_count()
+        self.config = config if config is not None else Config.fromParameters()
+        self.constraint = constraint
+        self.firstTest = firstTest
+        self.confidence = confidence
+        self.nElites = nElites
+        self.nDestroyOps = nDestroyOps
+        self.nRepairOps = nRepairOps
+        self.randomGen = random.Random(randomSeed)
+        self.blocks = [(instance,seed) for instance in instances for seed in seeds]
+        self.randomGen.shuffle(self.blocks)
+        self.results = dict() #(configuration, block) -> (best distance, CPU time)
+        self.storeFile = storeFile
+        self.store = None #opened by execute
+        self.nRuns = 0
+        self.cpuTime = 0.0
+        self.nStored = 0
+        self.storedTime = 0.0
+        self.nRunsAllBlocks = 0
+
+    def key(self,values):
+        """
+        Method that returns a hashable key of a configuration
+        """
+        return tuple(values[name] for name in self.space)
+
+    def sample(self,nConfigs,elites,spread,existing):
+        """
+        Method that samples new configurations. Without elites the values are drawn uniformly.
+        Otherwise a parent is drawn from the elites, with a larger probability for better
+        elites, and every value is drawn around the value of the parent, from a normal
+        distribution over the positions in the list of values with a standard deviation of
+        spread times the length of the list.
+        """
+        configs = []
+        keys = set(existing)
+        attempts = 0
+        while len(configs) < nConfigs and attempts < 100*nConfigs:
+            attempts += 1
+            if len(elites) == 0:
+                values = {name: self.randomGen.choice(domain) for name, domain in self.space.items()}
+            else:
+                weights = [len(elites)-r for r in range(len(elites))]
+                parent = self.randomGen.choices(elites,weights=weights)[0]
+                values = dict()
+                for name, domain in self.space.items():
+                    position = domain.index(parent[name]) + self.randomGen.gauss(0,spread*len(domain))
+                    values[name] = domain[min(len(domain)-1,max(0,round(position)))]
+            if (self.constraint is not None and not self.constraint(values)) or self.key(values) in keys:
+                continue
+            keys.add(self.key(values))
+            configs.append(values)
+        return configs
+
+    def evaluate(self,configs,block,pool):
+        """
+        Method that runs the configurations that were not run on the block yet
+        """
+        instance, seed = block
+        todo = [values for values in configs if (self.key(values),block) not in self.results]
+        cells = [(instance,values,seed) for values in todo]
+        storedRows, cells = storedCells(cells,self.config,self.nDestroyOps,self.nRepairOps,self.store)
+        for row in storedRows:
+            self.results[(self.key(row),block)] = (row["best_distance"],row["cpu_time"])
+            self.nStored += 1
+            self.storedTime += row["cpu_time"]
+        if pool is None:
+            rows = [runCell(cell,self.config,self.nDestroyOps,self.nRepairOps) for cell in cells]
+        else:
+            futures = [pool.submit(runCell,cell,self.config,self.nDestroyOps,self.nRepairOps) for cell in cells]
+            rows = [future.result() for future in futures]
+        for cell, row in zip(cells,rows):
+            storeRow(cell,row,self.config,self.nDestroyOps,self.nRepairOps,self.store)
+            self.results[(self.key(row),block)] = (row["best_distance"],row["cpu_time"])
+            self.nRuns += 1
+            self.cpuTime += row["cpu_time"]
+
+    def race(self,configs,budget,pool):
+        """
+        Method that races the configurations with at most budget new runs. Returns the
+        surviving configurations ordered by their mean rank, with their mean rank, mean distance
+        and number of infeasible solutions.
+        """
+        alive = list(configs)
+        startRuns = self.nRuns
+        knownResults = set(self.results)
+        nBlocks = 0
+        for block in self.blocks:
+            newRuns = sum((self.key(values),block) not in self.results for values in alive)
+            if nBlocks > 0 and (self.nRuns - startRuns + newRuns > budget or len(alive) <= self.nElites):
+                break
+            self.evaluate(alive,block,pool)
+            nBlocks += 1
+            if nBlocks >= self.firstTest and len(alive) > 1:
+                matrix = [[self.results[(self.key(values),b)][0] for values in alive] for b in self.blocks[:nBlocks]]
+                alive = [alive[j] for j in friedmanSurvivors(matrix,self.confidence)]
+        #every configuration that started the race would have been run on the evaluated blocks
+        self.nRunsAllBlocks += sum((self.key(values),block) not in knownResults for values in configs for block in self.blocks[:nBlocks])
+        matrix = [[self.results[(self.key(values),b)][0] for values in alive] for b in self.blocks[:nBlocks]]
+        rowRanks = [ranks(row) for row in matrix]
+        ranked = []
+        for j, values in enumerate(alive):
+            #runs with infeasible routes have extremely large distances, they are counted separately
+            distances = [row[j] for row in matrix if row[j] < sys.maxsize]
+            ranked.append({"values": values,
+                           "meanRank": sum(row[j] for row in rowRanks)/nBlocks,
+                           "meanDistance": sum(distances)/len(distances) if len(distances) > 0 else math.inf,
+                           "nInfeasible": nBlocks - len(distances)})
+        ranked.sort(key=lambda elite: elite["meanRank"])
+        return ranked
+
+    def execute(self):
+        """
+        Method that executes the races, the number of races grows with the number of
+        calibrated parameters as in irace
+        """
+        nRaces = 2 + int(math.log2(len(self.space)))
+        elites = []
+        pool = None
+        if self.nWorkers > 0:
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("fork" if "fork" in methods else None)
+            pool = ProcessPoolExecutor(max_workers=self.nWorkers,mp_context=context)
+        if self.storeFile is not None:
+            self.store = ResultStore(self.storeFile)
+        try:
+            for race in range(nRaces):
+                budget = (self.budget - self.nRuns)/(nRaces - race)
+                nConfigs = max(self.nElites+1,int(budget/(self.firstTest + min(5,race))))
+                spread = 0.5*(1 - race/nRaces)
+                eliteValues = [elite["values"] for elite in elites]
+                configs = eliteValues + self.sample(nConfigs - len(elites),eliteValues,spread,[self.key(values) for values in eliteValues])
+                elites = self.race(configs,budget,pool)[:self.nElites]
+                print(f"Race {race+1}/{nRaces}: {len(configs)} configurations, best mean rank {elites[0]['meanRank']:.2f}, {self.nRuns} runs in total")
+        finally:
+            if pool is not None:
+                pool.shutdown()
+            if self.store is not None:
+                self.store.close()
+                self.store = None
+        self.elites = elites
+
+    def report(self):
+        """
+        Method that prints the elite configurations and the CPU time saved. The saving is
+        estimated with the mean CPU time of a run: compared to running every raced configuration
+        on all blocks of its race, and compared to the full grid of the space on all blocks.
+        """
+        for r, elite in enumerate(self.elites,1):
+            values = ", ".join(f"{name}={value}" for name, value in elite["values"].items())
+            print(f"elite {r}: {values} (mean rank {elite['meanRank']:.2f}, mean distance {elite['meanDistance']:.2f}, {elite['nInfeasible']} infeasible)")
+        meanTime = (self.cpuTime + self.storedTime)/(self.nRuns + self.nStored)
+        gridSize = math.prod(len(domain) for domain in self.space.values())
+        gridTime = gridSize*len(self.blocks)*meanTime
+        print(f"{self.nRuns} runs, {self.cpuTime:.1f} CPU seconds, {self.nStored} runs taken from the store ({self.storedTime:.1f} CPU seconds)")
+        print(f"without discarding: {self.nRunsAllBlocks} runs, about {self.nRunsAllBlocks*meanTime:.1f} CPU seconds, saved {self.nRunsAllBlocks*meanTime - self.cpuTime:.1f}")
+        print(f"full grid: {gridSize*len(self.blocks)} runs, about {gridTime:.0f} CPU seconds, saved {gridTime - self.cpuTime:.0f}")
+
+
+if __name__ == "__main__":
+    budget = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    nWorkers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    instance_dir = "Instances"
+    instances = [os.path.join(instance_dir,instance_file) for instance_file in sorted(os.listdir(instance_dir))]
+    space = {
+        "coolingRate": [0.1, 0.3, 0.5, 0.6, 0.7, 0.8, 0.9],
+        "startTempControl": [0.05, 0.1, 0.2, 0.3, 0.5, 0.8],
+        "updateSpeed": [0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9],
+        "minSizeNBH": [0, 5, 10, 15, 20, 25, 30, 35, 40],
+        "maxSizeNBH": [10, 15, 20, 25, 30, 35, 40, 45],
+        "p": [1, 2, 3, 4, 5, 6, 8, 10],
+        "Regretk": [2, 3, 4],
+        "alpha": [0, 0.1, 0.25, 0.5, 0.75, 1],
+    }
+    racing = Racing(space,instances,[1,2,3],budget,nWorkers,
+                    constraint=lambda values: values["minSizeNBH"] <= values["maxSizeNBH"])
+    racing.execute()
+    racing.report()
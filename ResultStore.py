@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Stores the results of runs of the ALNS in an SQLite database, keyed by the content of the
+instance file, the configuration, the seed and the version of the code, such that a run
+that was executed before is not executed again.
+Usage: python ResultStore.py [database] [instance]
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import dataclasses
+import pandas as pd
+from Config import Config
+
+
+#files of the code that determine the result of a run
+solverFiles = ["ALNS.py","Solution.py","Route.py","Problem.py","LocalSearch.py","ParallelALNS.py","Config.py"]
+#attributes of Config that do not change the result of a run, they are not part of the key
+nonSemanticFields = ["useInstanceCache","instanceCacheDir","candidateWorkers","checkDistances",
+                     "routeCacheSize","compactRoutes","vectorizedInsertion","vectorizeMinLength"]
+
+
+def configValues(config):
+    """
+    Method that returns the values of the configuration that change the result of a run
+    """
+    values = config.asDict()
+    for name in nonSemanticFields:
+        del values[name]
+    return values
+
+
+def jsonValue(value):
+    """
+    Method that converts values that json can not write, e.g. numpy numbers
+    """
+    if hasattr(value,"item"):
+        return value.item()
+    return str(value)
+
+
+class ResultStore:
+    """
+    Class that stores the results of runs of the ALNS. A run is identified by a key: the hash
+    of the content of the instance file, of the values of the configuration that change the
+    result (configValues, including the seed), of the number of operators and of the code in
+    solverFiles. Renaming an instance file, or changing e.g. the caches or the number of
+    processes does not change the key, changing its content, a parameter or the code does.
+    For every run the best distance, the routes, the CPU time and the trace (the distance
+    found and the best distance in every iteration) are stored.
+
+    The result of a run with config.timeBudget depends on the speed of the computer, such
+    runs are not stored and not looked up (isReproducible).
+
+    Parameters
+    ----------
+    fileName : str
+        the SQLite database, created if it does not exist
+    codeVersion : str
+        hash of the code in solverFiles
+    """
+    def __init__(self,fileName="cache/results.sqlite"):
+        self.fileName = fileName
+        if os.path.dirname(fileName) != "":
+            os.makedirs(os.path.dirname(fileName),exist_ok=True)
+        #several experiments may write to the same database, sqlite waits for the lock
+        self.connection = sqlite3.connect(fileName,timeout=60)
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS runs (
+            key TEXT PRIMARY KEY, instance TEXT, instance_hash TEXT, code_version TEXT,
+            seed INTEGER, n_destroy_ops INTEGER, n_repair_ops INTEGER, config TEXT,
+            best_distance REAL, n_routes INTEGER, n_not_served INTEGER, cpu_time REAL,
+            routes TEXT, trace TEXT, created REAL)""")
+        self.connection.commit()
+        self.codeVersion = ResultStore.codeHash()
+        self.instanceHashes = dict() #(file, modification time) -> hash of the content
+
+    @staticmethod
+    def codeHash():
+        """
+        Method that returns the hash of the code in solverFiles
+        """
+        digest = hashlib.sha1()
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for fileName in solverFiles:
+            with open(os.path.join(directory,fileName),"rb") as file:
+                digest.update(file.read())
+        return digest.hexdigest()
+
+    def instanceHash(self,fileName):
+        """
+        Method that returns the hash of the content of an instance file
+        """
+        key = (os.path.abspath(fileName),os.path.getmtime(fileName))
+        if key not in self.instanceHashes:
+            with open(fileName,"rb") as file:
+                self.instanceHashes[key] = hashlib.sha1(file.read()).hexdigest()
+        return self.instanceHashes[key]
+
+    def key(self,instance,config,nDestroyOps,nRepairOps):
+        """
+        Method that returns the key of a run of the instance with the configuration
+        """
+        values = json.dumps(configValues(config),sort_keys=True,default=jsonValue)
+        content = "|".join([self.instanceHash(instance),values,str(nDestroyOps),str(nRepairOps),self.codeVersion])
+        return hashlib.sha1(content.encode()).hexdigest()
+
+    @staticmethod
+    def isReproducible(config):
+        """
+        Method that returns True if a run with the configuration gives the same result on
+        every computer, i.e. if it has no time budget
+        """
+        return config.timeBudget is None
+
+    def get(self,instance,config,nDestroyOps,nRepairOps):
+        """
+        Method that returns the stored result of a run as a dict with best_distance, n_routes,
+        n_not_served, cpu_time, routes and trace, or None if the run is not stored or not
+        reproducible
+        """
+        if not ResultStore.isReproducible(config):
+            return None
+        cursor = self.connection.execute("SELECT best_distance, n_routes, n_not_served, cpu_time, routes, trace FROM runs WHERE key = ?",
+                                         (self.key(instance,config,nDestroyOps,nRepairOps),))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return {"best_distance": row[0],
+                "n_routes": row[1],
+                "n_not_served": row[2],
+                "cpu_time": row[3],
+                "routes": json.loads(row[4]),
+                "trace": [tuple(item) for item in json.loads(row[5])]}
+
+    def put(self,instance,config,nDestroyOps,nRepairOps,result):
+        """
+        Method that stores the result of a run, a dict as returned by get. Runs that are not
+        reproducible are not stored.
+        """
+        if not ResultStore.isReproducible(config):
+            return
+        self.connection.execute("INSERT OR REPLACE INTO runs VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
+                                (self.key(instance,config,nDestroyOps,nRepairOps),os.path.basename(instance),
+                                 self.instanceHash(instance),self.codeVersion,config.randomSeed,nDestroyOps,nRepairOps,
+                                 json.dumps(config.asDict(),sort_keys=True,default=jsonValue),
+                                 float(result["best_distance"]),int(result["n_routes"]),int(result["n_not_served"]),
+                                 float(result["cpu_time"]),json.dumps(result["routes"]),
+                                 json.dumps(result["trace"],default=jsonValue),time.time()))
+        self.connection.commit()
+
+    def results(self,instance=None,currentCode=True):
+        """
+        Method that returns the stored runs as a DataFrame with a column per value of the
+        configuration, optionally only those of an instance (the name of the file) and of
+        the current version of the code
+        """
+        query = "SELECT instance, seed, best_distance, n_routes, n_not_served, cpu_time, code_version, config, created FROM runs WHERE 1 = 1"
+        arguments = []
+        if instance is not None:
+            query += " AND instance = ?"
+            arguments.append(os.path.basename(instance))
+        if currentCode:
+            query += " AND code_version = ?"
+            arguments.append(self.codeVersion)
+        df = pd.read_sql_query(query + " ORDER BY created",self.connection,params=arguments)
+        names = [field.name for field in dataclasses.fields(Config) if field.name != "randomSeed"]
+        configs = pd.DataFrame([json.loads(values) for values in df["config"]],columns=names,index=df.index)
+        return pd.concat([df.drop(columns="config"),configs],axis=1)
+
+    def close(self):
+        """
+        Method that closes the database
+        """
+        self.connection.close()
+
+
+if __name__ == "__main__":
+    store = ResultStore(sys.argv[1] if len(sys.argv) > 1 else "cache/results.sqlite")
+    df = store.results(sys.argv[2] if len(sys.argv) > 2 else None)
+    print(f"{len(df)} runs of the current code in {store.fileName}")
+    if len(df) > 0:
+        print(df.groupby("instance")["best_distance"].agg(["count","min","mean"]))
+    store.close()
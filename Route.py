@@ -5,8 +5,11 @@ Created on Thu Jul 28 17:10:03 2022
 @author: Original template by Rolf van Lieshout
 """
 import sys
+import math
+import numpy as np
+from array import array
 from Problem import Location
-from Parameters import Parameters
+from Config import Config
 
 class Route:
     """
@@ -24,27 +27,42 @@ class Route:
         true if route respects time windows, capacity and precedence
     distance : int
         total distance driven, extremely large number if infeasible
+    config : Config
+        parameters of the run, by default the current values of Parameters
+        
+    If feasible and distance are given, they are not checked again. This is used
+    when they are known already, e.g. when a route is copied.
+    Otherwise they are taken from the route cache of the problem if the same sequence
+    of locations was evaluated before, see PDPTW.evaluateRoute.
     """
-    def __init__(self,locations,requests,problem):
+    def __init__(self,locations,requests,problem,feasible=None,distance=None,config=None):
         self.locations = locations
         self.requests = requests
         self.problem = problem
-        #check the feasibility and compute the distance
-        self.feasible = self.isFeasible()
-        if self.feasible: 
-            self.distance = self.computeDistance()
+        self.config = config if config is not None else Config.fromParameters()
+        if feasible is not None:
+            self.feasible = feasible
+            self.distance = distance
+            if self.config.checkDistances:
+                self.checkDistance()
         else:
-            self.distance = sys.maxsize #extremely large number
+            #check the feasibility and compute the distance, or look them up if the route was evaluated before
+            self.feasible, self.distance = problem.evaluateRoute(self)
+        #profiles used to evaluate insertions, computed when first needed
+        self.arrivalTimes = None
+        self.cumWaiting = None
             
     def computeDistance(self):
         """
         Method that computes and returns the distance of the route
         """
         totDist = 0
-        for i in range(1,len(self.locations)-1):
-            prevNode = self.locations[i-1]
-            curNode = self.locations[i]
-            dist = self.problem.distMatrix[prevNode.nodeID][curNode.nodeID]
+        distances = self.problem.distances
+        locations = self.locations
+        for i in range(1,len(locations)-1):
+            prevNode = locations[i-1]
+            curNode = locations[i]
+            dist = distances[prevNode.nodeID][curNode.nodeID]
             totDist += dist
         return totDist
     
@@ -63,21 +81,23 @@ class Route:
         Method that checks feasbility. Returns True if feasible, else False
         """
         #route should start and end at the depot
-        if self.locations[0]!=self.problem.depot or self.locations[-1]!=self.problem.depot:  
+        locations = self.locations
+        if locations[0]!=self.problem.depot or locations[-1]!=self.problem.depot:  
             return False
                             
         curTime = 0 #current time
         curLoad = 0 #current load in vehicle
-        curNode = self.locations[0] #current node
+        curNode = locations[0] #current node
         pickedUp = set() #set with all requests that we picked up, used to check precedence
         
         #totDistance = 0
         curCharge = self.problem.battery
+        distances = self.problem.distances
         #iterate over route and check feasibility of time windows, capacity and precedence
-        for i in range(1,len(self.locations)-1):
-            prevNode = self.locations[i-1]
-            curNode = self.locations[i]
-            dist = self.problem.distMatrix[prevNode.nodeID][curNode.nodeID]
+        for i in range(1,len(locations)-1):
+            prevNode = locations[i-1]
+            curNode = locations[i]
+            dist = distances[prevNode.nodeID][curNode.nodeID]
             curTime = max(curNode.startTW, curTime + prevNode.servTime + dist)
             #totDistance += dist
             #check if time window is respected
@@ -89,7 +109,7 @@ class Route:
             if curLoad>self.problem.capacity:
                 return False
             #check if vehicle has enough charge
-            if Parameters.useBattery:
+            if self.config.useBattery:
                 curCharge = curCharge - dist
                 if curCharge < 0:
                    return False
@@ -109,24 +129,407 @@ class Route:
             return False
         return True
     
+    def evaluate(self):
+        """
+        Method that checks the feasibility and computes the distance of the route, 
+        returns them as a tuple (feasible, distance)
+        """
+        feasible = self.isFeasible()
+        if feasible: 
+            distance = self.computeDistance()
+        else:
+            distance = sys.maxsize #extremely large number
+        return feasible, distance
+        
+    def checkDistance(self):
+        """
+        Method that checks the feasibility and distance of the route against a full 
+        recomputation, used if config.checkDistances
+        """
+        feasible = self.isFeasible()
+        if feasible != self.feasible:
+            raise Exception(f"Route feasibility {self.feasible} does not match recomputed {feasible}")
+        if feasible and not math.isclose(self.distance,self.computeDistance(),rel_tol=1e-9,abs_tol=1e-6):
+            raise Exception(f"Route distance {self.distance} does not match recomputed {self.computeDistance()}")
+    
     def removeRequest(self,request):
         """
-        Method that removes a request from the route. 
+        Method that removes a request from the route. The distance is updated 
+        with the arcs around the pickup and delivery.
         """
+        locations = self.locations
+        a = locations.index(request.pickUpLoc)
+        b = locations.index(request.deliveryLoc)
+        saving = self.removalSaving(locations,a,b)
         #remove the request, the pickup and the delivery
         self.requests.remove(request)
-        self.locations.remove(request.pickUpLoc)
-        self.locations.remove(request.deliveryLoc)
-        #the distance changes, so update
-        self.distance = self.computeDistance()
+        self.removePositions(a,b)
+        if self.feasible:
+            #removing a request does not delay the vehicle or increase the load, so it stays feasible
+            self.distance -= saving
+            if self.config.checkDistances:
+                self.checkDistance()
+        else:
+            #removing can make an infeasible route feasible again
+            self.distance = self.computeDistance()
+            self.feasible = self.isFeasible()
+        #the profiles are outdated, they are computed again when needed
+        self.arrivalTimes = None
+        self.cumWaiting = None
+        
+    def removePositions(self,a,b):
+        """
+        Method that removes the locations at positions a < b from the route
+        """
+        del self.locations[b]
+        del self.locations[a]
+        
+    def removalSaving(self,locations,a,b):
+        """
+        Method that returns the decrease in distance if the locations at positions a < b
+        are removed, computed from the arcs around them
+        """
+        dist = self.problem.distances
+        last = len(locations)-1 #the arc towards the final depot is not counted
+        
+        def arc(x,y):
+            if y == last:
+                return 0
+            return dist[locations[x].nodeID][locations[y].nodeID]
+        
+        if b == a+1:
+            return arc(a-1,a) + arc(a,b) + arc(b,b+1) - arc(a-1,b+1)
+        return (arc(a-1,a) + arc(a,a+1) - arc(a-1,a+1)) + (arc(b-1,b) + arc(b,b+1) - arc(b-1,b+1))
      
+    def removalSavings(self):
+        """
+        Method that returns a dict with, for each request in the route, the decrease in 
+        distance if it is removed. This is computed from the arcs around the pickup and 
+        delivery, without changing the route.
+        """
+        locations = self.locations
+        pickUpPos = dict()
+        savings = dict()
+        for pos in range(1,len(locations)-1):
+            loc = locations[pos]
+            if loc.typeLoc == 1:
+                pickUpPos[loc.requestID] = pos
+                continue
+            savings[loc.requestID] = self.removalSaving(locations,pickUpPos[loc.requestID],pos)
+        if not self.feasible:
+            #the distance of an infeasible route is an extremely large number
+            pathDist = self.computeDistance()
+            for reqID in savings:
+                savings[reqID] = self.distance - (pathDist - savings[reqID])
+        return savings
+        
     def copy(self):
         """
-        Method that returns a copy of the route
+        Method that returns a copy of the route. The feasibility and distance are 
+        copied instead of checked again.
+        """
+        locationsCopy = self.locations.copy()
+        requestsCopy = self.requests.copy()
+        return Route(locationsCopy,requestsCopy,self.problem,self.feasible,self.distance,self.config)
+    
+    def computeProfiles(self):
+        """
+        Method that computes the forward and backward profiles of the route. 
+        These are used to check the feasibility of an insertion in constant time.
+
+        arrivalTimes : list of floats
+            start of service at each position (forward)
+        latestTimes : list of floats
+            latest start of service at each position such that the remainder 
+            of the route stays feasible, i.e. the forward time slack (backward)
+        loads : list of ints
+            load in the vehicle after leaving each position (forward)
+        pathDistances : list of floats
+            distance driven up to each position (forward)
+        openRequests : list of ints
+            number of requests that are picked up but not delivered after leaving each 
+            position (forward), the route can only be split where this is 0
+        
+        The remaining battery is not stored per position: the charge only decreases
+        along the route, so it is enough to check the total distance against the battery.
+        """
+        locations = self.locations
+        n = len(locations)
+        dist = self.problem.distances
+        self.arrivalTimes = [0]*n
+        self.loads = [0]*n
+        self.pathDistances = [0]*n
+        self.openRequests = [0]*n
+        for k in range(1,n-1):
+            prevNode = locations[k-1]
+            curNode = locations[k]
+            travel = dist[prevNode.nodeID][curNode.nodeID]
+            self.arrivalTimes[k] = max(curNode.startTW, self.arrivalTimes[k-1] + prevNode.servTime + travel)
+            self.loads[k] = self.loads[k-1] + curNode.demand
+            self.pathDistances[k] = self.pathDistances[k-1] + travel
+            self.openRequests[k] = self.openRequests[k-1] + curNode.typeLoc
+        if n > 1:
+            #the arc towards the final depot is not counted
+            self.pathDistances[n-1] = self.pathDistances[n-2]
+        #the time window of the final depot is not checked, so there is no limit there
+        self.latestTimes = [float("inf")]*n
+        for k in range(n-2,0,-1):
+            curNode = locations[k]
+            nextNode = locations[k+1]
+            travel = dist[curNode.nodeID][nextNode.nodeID]
+            self.latestTimes[k] = min(curNode.endTW, self.latestTimes[k+1] - curNode.servTime - travel)
+        
+    def bestInsertion(self,request):
+        """
+        Method that finds the positions to insert the pickup and delivery of a 
+        request that give the shortest total distance, without constructing any routes.
+        Every position pair is checked in constant time using the route profiles.
+        Positions that would use an incompatible arc (PDPTW.computeCompatibility) are 
+        skipped without checking the time windows.
+
+        Parameters
+        ----------
+        request : Request
+            the request that should be inserted.
+
+        Returns
+        -------
+        bestI : int
+            position of the pickup, None if no insertion is feasible.
+        bestJ : int
+            position of the delivery, in the route after the pickup is inserted.
+        minDist : float
+            distance of the route after insertion, extremely large number if infeasible.
+
+        """
+        minDist = sys.maxsize #initialize as extremely large number
+        bestI = None
+        bestJ = None
+        if self.arrivalTimes is None:
+            self.computeProfiles()
+        if not self.feasible:
+            #inserting can only delay the vehicle and increase load and distance
+            return bestI, bestJ, minDist
+        locations = self.locations
+        if self.config.vectorizedInsertion and len(locations) >= self.config.vectorizeMinLength:
+            return self.bestInsertionVectorized(request)
+        
+        arrivalTimes = self.arrivalTimes
+        latestTimes = self.latestTimes
+        loads = self.loads
+        dist = self.problem.distances
+        capacity = self.problem.capacity
+        battery = self.problem.battery if self.config.useBattery else float("inf")
+        pickUp = request.pickUpLoc
+        delivery = request.deliveryLoc
+        pID = pickUp.nodeID
+        dID = delivery.nodeID
+        last = len(locations)-1 #position of the final depot, the arc towards it is not counted
+        #with a granular neighbourhood, the pickup and the delivery should each use a granular arc
+        granular = None
+        if self.config.granularity is not None:
+            granular = self.problem.getGranularArcs(self.config.granularity)[1]
+        compatible = self.problem.compatibleArcs
+        usable = True
+        #iterate over all possible insertion positions for pickup and delivery
+        for i in range(1,last+1):
+            prevNode = locations[i-1]
+            nextNode = locations[i]
+            if loads[i-1] + pickUp.demand > capacity or not compatible[prevNode.nodeID][pID]:
+                continue
+            #without a compatible arc from the pickup to the next node, the delivery should follow the pickup
+            pickUpCompatible = compatible[pID][nextNode.nodeID]
+            if granular is not None:
+                pickUpGranular = granular[prevNode.nodeID][pID] or granular[pID][nextNode.nodeID]
+                #without a granular arc of the pickup, only the delivery directly after it can be used
+                if not pickUpGranular and not granular[pID][dID]:
+                    continue
+            timeP = max(pickUp.startTW, arrivalTimes[i-1] + prevNode.servTime + dist[prevNode.nodeID][pID])
+            if timeP > pickUp.endTW:
+                continue
+            if i == last:
+                deltaP = dist[prevNode.nodeID][pID]
+            else:
+                deltaP = dist[prevNode.nodeID][pID] + dist[pID][nextNode.nodeID] - dist[prevNode.nodeID][nextNode.nodeID]
+            #the delivery is inserted between beforeNode and the node at position j,
+            #time is the start of service at beforeNode after inserting the pickup
+            beforeNode = pickUp
+            time = timeP
+            for j in range(i,last+1):
+                afterNode = locations[j]
+                timeD = max(delivery.startTW, time + beforeNode.servTime + dist[beforeNode.nodeID][dID])
+                usable = compatible[beforeNode.nodeID][dID] and compatible[dID][afterNode.nodeID]
+                if granular is not None and usable:
+                    if j == i:
+                        usable = granular[pID][dID] or (granular[prevNode.nodeID][pID] and granular[dID][afterNode.nodeID])
+                    else:
+                        usable = pickUpGranular and (granular[beforeNode.nodeID][dID] or granular[dID][afterNode.nodeID])
+                #the load after the delivery is as in the original route, since the demands cancel out
+                if usable and timeD <= delivery.endTW and (j == last or max(afterNode.startTW, timeD + delivery.servTime + dist[dID][afterNode.nodeID]) <= latestTimes[j]):
+                    if j == i:
+                        if j == last:
+                            delta = dist[prevNode.nodeID][pID] + dist[pID][dID]
+                        else:
+                            delta = dist[prevNode.nodeID][pID] + dist[pID][dID] + dist[dID][afterNode.nodeID] - dist[prevNode.nodeID][afterNode.nodeID]
+                    elif j == last:
+                        delta = deltaP + dist[beforeNode.nodeID][dID]
+                    else:
+                        delta = deltaP + (dist[beforeNode.nodeID][dID] + dist[dID][afterNode.nodeID] - dist[beforeNode.nodeID][afterNode.nodeID])
+                    newDist = self.distance + delta
+                    #check if vehicle has enough charge and if cheapest
+                    if newDist <= battery and newDist < minDist:
+                        bestI = i
+                        bestJ = j+1
+                        minDist = newDist
+                if j == last or not pickUpCompatible or (granular is not None and not pickUpGranular):
+                    break
+                #the node at position j now comes between pickup and delivery
+                time = max(afterNode.startTW, time + beforeNode.servTime + dist[beforeNode.nodeID][afterNode.nodeID])
+                if time > latestTimes[j] or loads[j] + pickUp.demand > capacity:
+                    #delaying further or carrying the request longer cannot become feasible
+                    break
+                beforeNode = afterNode
+        
+        return bestI, bestJ, minDist
+    
+    def nodeSequence(self):
+        """
+        Method that returns the nodeIDs of the locations on the route
+        """
+        return [loc.nodeID for loc in self.locations]
+    
+    def computeProfileArrays(self):
+        """
+        Method that stores the route profiles and the attributes of the locations 
+        on the route as numpy arrays, used by the vectorized insertion
+        """
+        if self.arrivalTimes is None:
+            self.computeProfiles()
+        self.nodeIDs = np.array(self.nodeSequence())
+        self.startTWs = self.problem.startTW[self.nodeIDs]
+        self.servTimes = self.problem.servTime[self.nodeIDs]
+        self.arrivalArray = np.array(self.arrivalTimes,dtype=float)
+        self.latestArray = np.array(self.latestTimes,dtype=float)
+        self.loadArray = np.array(self.loads,dtype=float)
+        #waiting time before the start of service at each position, cumulated along the route
+        travel = self.problem.distMatrix[self.nodeIDs[:-1],self.nodeIDs[1:]]
+        waiting = self.arrivalArray[1:] - (self.arrivalArray[:-1] + self.servTimes[:-1] + travel)
+        self.cumWaiting = np.concatenate(([0.0],np.cumsum(waiting)))
+    
+    def bestInsertionVectorized(self,request):
+        """
+        Method that evaluates all pickup and delivery position pairs of a request at once
+        with numpy, and returns the same insertion as the loop in bestInsertion.
+        
+        When the pickup is inserted before position i, the start of service at 
+        a later position k is pushed forward by max(0, pushForward_i - waiting between i and k).
+        The capacity, time window and battery violations are masks over all pairs.
+        Incompatible arcs have an infinite distance (PDPTW.compatibleDistances), so the
+        positions that use them violate the time windows.
+
+        Parameters
+        ----------
+        request : Request
+            the request that should be inserted.
+
+        Returns
+        -------
+        bestI : int
+            position of the pickup, None if no insertion is feasible.
+        bestJ : int
+            position of the delivery, in the route after the pickup is inserted.
+        minDist : float
+            distance of the route after insertion, extremely large number if infeasible.
+
+        """
+        if self.arrivalTimes is None or self.cumWaiting is None:
+            self.computeProfileArrays()
+        dist = self.problem.compatibleDistances
+        capacity = self.problem.capacity
+        battery = self.problem.battery if self.config.useBattery else float("inf")
+        pickUp = request.pickUpLoc
+        delivery = request.deliveryLoc
+        pID = pickUp.nodeID
+        dID = delivery.nodeID
+        ids = self.nodeIDs
+        arrival = self.arrivalArray
+        latest = self.latestArray
+        loads = self.loadArray
+        startTW = self.startTWs
+        servTime = self.servTimes
+        last = len(ids)-1 #position of the final depot, the arc towards it is not counted
+        
+        #pickup between position i-1 and i, for i = 1..last (row i-1)
+        prevToP = dist[ids[:-1],pID]
+        pToNext = dist[pID,ids[1:]]
+        prevToNext = dist[ids[:-1],ids[1:]]
+        pToNext[-1] = 0
+        prevToNext[-1] = 0
+        deltaP = prevToP + pToNext - prevToNext
+        timeP = np.maximum(pickUp.startTW, arrival[:-1] + servTime[:-1] + prevToP)
+        okP = (timeP <= pickUp.endTW) & (loads[:-1] + pickUp.demand <= capacity)
+        
+        #start of service at position k (column k-1) after inserting the pickup before i
+        pushForward = np.maximum(startTW[1:], timeP + pickUp.servTime + dist[pID,ids[1:]]) - arrival[1:]
+        slack = self.cumWaiting[None,1:] - self.cumWaiting[1:,None]
+        shifted = arrival[None,1:] + np.maximum(0.0, pushForward[:,None] - slack)
+        #positions i..k can all be passed while carrying the request
+        upper = np.triu(np.ones((last,last),dtype=bool))
+        okK = (shifted <= latest[None,1:]) & (loads[None,1:] + pickUp.demand <= capacity)
+        okK = np.logical_and.accumulate(okK | ~upper,axis=1)
+        
+        #delivery between position j-1 and j, for j = i+1..last (column j-1)
+        beforeToD = dist[ids[:-1],dID]
+        dToAfter = dist[dID,ids[1:]]
+        dToAfter[-1] = 0
+        deltaD = beforeToD + dToAfter - prevToNext
+        timeD = np.empty((last,last))
+        timeD[:,1:] = np.maximum(delivery.startTW, shifted[:,:-1] + servTime[None,1:-1] + beforeToD[None,1:])
+        ok = np.zeros((last,last),dtype=bool)
+        ok[:,1:] = okK[:,:-1]
+        delta = deltaP[:,None] + deltaD[None,:]
+        #delivery directly after the pickup (diagonal)
+        diag = np.arange(last)
+        timeD[diag,diag] = np.maximum(delivery.startTW, timeP + pickUp.servTime + dist[pID,dID])
+        ok[diag,diag] = True
+        delta[diag,diag] = prevToP + dist[pID,dID] + dToAfter - prevToNext
+        #the node after the delivery must be reached before its latest start
+        timeAfter = np.maximum(startTW[None,1:], timeD + delivery.servTime + dToAfter[None,:])
+        okAfter = timeAfter <= latest[None,1:]
+        okAfter[:,-1] = True
+        newDist = self.distance + delta
+        ok &= upper & okP[:,None] & (timeD <= delivery.endTW) & okAfter & (newDist <= battery)
+        if self.config.granularity is not None:
+            #the pickup and the delivery should each use a granular arc
+            granular = self.problem.getGranularArcs(self.config.granularity)[0]
+            pickUpGranular = granular[ids[:-1],pID] | granular[pID,ids[1:]]
+            deliveryGranular = granular[ids[:-1],dID] | granular[dID,ids[1:]]
+            usable = pickUpGranular[:,None] & deliveryGranular[None,:]
+            usable[diag,diag] = granular[pID,dID] | (granular[ids[:-1],pID] & granular[dID,ids[1:]])
+            ok &= usable
+        if not ok.any():
+            return None, None, sys.maxsize
+        newDist[~ok] = np.inf
+        best = int(np.argmin(newDist))
+        minDist = float(newDist.flat[best])
+        row, col = divmod(best,last)
+        return row+1, col+2, minDist
+    
+    def insertAt(self,request,i,j,distance=None):
+        """
+        Method that returns a new route where the pickup of a request is inserted 
+        at position i and the delivery at position j (after inserting the pickup).
+        If the distance after insertion is given, e.g. by bestInsertion, the insertion
+        is known to be feasible and the new route is not checked again.
         """
         locationsCopy = self.locations.copy()
+        locationsCopy.insert(i,request.pickUpLoc)
+        locationsCopy.insert(j,request.deliveryLoc)
         requestsCopy = self.requests.copy()
-        return Route(locationsCopy,requestsCopy,self.problem)
+        requestsCopy.append(request)
+        if distance is not None:
+            return Route(locationsCopy,requestsCopy,self.problem,True,distance,self.config)
+        return Route(locationsCopy,requestsCopy,self.problem,config=self.config)
     
     def greedyInsert(self,request):
         """
@@ -141,54 +544,192 @@ class Route:
         Returns
         -------
         bestInsert : Route
-            Route with the best insertion.
+            Route with the best insertion, None if no insertion is feasible.
+        minDist : float
+            distance of the route after insertion.
 
         """
-        requestsCopy = self.requests.copy()
-        requestsCopy.append(request)
-        
-        minDist = sys.maxsize #initialize as extremely large number
-        bestInsert = None
-        #iterate over all possible insertion positions for pickup and delivery
-        for i in range(1,len(self.locations)):
-            for j in range(i+1,len(self.locations)+1): #delivery after pickup
-                locationsCopy = self.locations.copy()
-                locationsCopy.insert(i,request.pickUpLoc)
-                locationsCopy.insert(j,request.deliveryLoc)
-                afterInsertion = Route(locationsCopy,requestsCopy,self.problem)
-                #check if insertion is feasible
-                if afterInsertion.feasible:
-                    #check if cheapest
-                    if afterInsertion.distance<minDist:
-                        bestInsert = afterInsertion
-                        minDist = afterInsertion.distance
-        
+        i, j, minDist = self.bestInsertion(request)
+        if i is None:
+            return None, minDist
+        bestInsert = self.insertAt(request,i,j,minDist)
         return bestInsert, minDist
     
     
     def twoOpt(self):
         """
-        applies the 2-opt heuristic to the route.
+        applies the 2-opt heuristic to the route. A move reverses the locations between positions i and j.
+        
+        Segments with both the pickup and the delivery of a request are skipped, since reversing
+        them breaks the precedence. Every other move is evaluated in constant time: the distance
+        from the arcs that change, the load from the smallest load in the segment, and the time 
+        windows from the route profiles and the time window data of the reversed segment, which 
+        is extended one location at a time (Vidal et al., 2013). The first improving move is 
+        applied. Locations from which no improving move is found are not searched again until 
+        one of their arcs changes (don't-look bits).
+        
+        Returns the improved route, or the route itself if there is no improvement.
         """
+        #infeasible routes have an extremely large distance, which is not improved this way
+        if not self.feasible or len(self.requests) < 2:
+            return self
+        problem = self.problem
+        dist = problem.distances
+        capacity = problem.capacity
+        battery = problem.battery if self.config.useBattery else float("inf")
+        current = Route(self.locations.copy(),self.requests.copy(),problem,True,self.distance,self.config)
+        locations = current.locations
+        last = len(locations)-1 #position of the final depot, the arc towards it is not counted
+        granular = None
+        if self.config.granularity is not None:
+            granular = problem.getGranularArcs(self.config.granularity)[1]
+        dontLook = set()
         improved = True
-        current_route = self
         while improved:
             improved = False
-            best_distance = current_route.distance
-            for i in range(1, len(current_route.locations) - 2):
-                for j in range(i + 1, len(current_route.locations) - 1):
+            current.computeProfiles()
+            arrival = current.arrivalTimes
+            latest = current.latestTimes
+            loads = current.loads
+            pathDist = current.pathDistances
+            ids = [loc.nodeID for loc in locations]
+            #maxJ[i]: last position j such that positions i..j hold no pickup and delivery of the same request
+            maxJ = [last-1]*(last+1)
+            pickUpPos = dict()
+            for k in range(1,last):
+                if locations[k].typeLoc == 1:
+                    pickUpPos[locations[k].requestID] = k
+                else:
+                    maxJ[pickUpPos[locations[k].requestID]] = k-1
+            for k in range(last-2,0,-1):
+                maxJ[k] = min(maxJ[k],maxJ[k+1])
+            
+            for i in range(1,last-1):
+                if ids[i] in dontLook:
+                    continue
+                first = locations[i]
+                #time window data of the reversed segment j..i: duration, earliest and latest start
+                duration = first.servTime
+                earliest = first.startTW
+                latestStart = first.endTW
+                reversedDist = 0
+                minLoad = loads[i-1]
+                removedArc = dist[ids[i-1]][ids[i]]
+                for j in range(i+1,maxJ[i]+1):
+                    loc = locations[j]
+                    travel = dist[ids[j]][ids[j-1]]
+                    reversedDist += travel
+                    #concatenate location j in front of the reversed segment
+                    delta = loc.servTime + travel
+                    if loc.startTW + delta > latestStart:
+                        #the reversed segment cannot be feasible, also when it is extended
+                        break
+                    waiting = max(earliest - delta - loc.endTW, 0)
+                    duration += delta + waiting
+                    earliest = max(earliest - delta, loc.startTW) - waiting
+                    latestStart = min(latestStart - delta, loc.endTW)
+                    minLoad = min(minLoad, loads[j-1])
                     
-                    new_locations = current_route.locations[:i] + current_route.locations[i:j+1][::-1] + current_route.locations[j+1:]
-                    new_route = Route(new_locations, current_route.requests, current_route.problem)
-
-                    # If the new route is feasible and better
-                    if new_route.isFeasible() and new_route.distance < best_distance: # This may resaults to some routes which are not two opt because the two opt version of them are not feasible
-                        current_route = new_route
-                        best_distance = new_route.distance
-                        improved = True
-                        
-                        
-                        break  
+                    if j+1 == last:
+                        newDist = pathDist[i-1] + dist[ids[i-1]][ids[j]] + reversedDist
+                    else:
+                        newDist = current.distance - removedArc - dist[ids[j]][ids[j+1]] + dist[ids[i-1]][ids[j]] + dist[ids[i]][ids[j+1]] - (pathDist[j] - pathDist[i]) + reversedDist
+                    #small tolerance, such that rounding errors are not seen as improvements
+                    if newDist >= current.distance - 1e-9 or newDist > battery:
+                        continue
+                    if granular is not None and not (granular[ids[i-1]][ids[j]] or granular[ids[i]][ids[j+1]]):
+                        continue
+                    if loads[i-1] + loads[j] - minLoad > capacity:
+                        continue
+                    arrivalTime = arrival[i-1] + locations[i-1].servTime + dist[ids[i-1]][ids[j]]
+                    if arrivalTime > latestStart:
+                        continue
+                    if j+1 < last:
+                        finish = max(arrivalTime,earliest) + duration
+                        if max(locations[j+1].startTW, finish + dist[ids[i]][ids[j+1]]) > latest[j+1]:
+                            continue
+                    #apply the move, the locations next to the changed arcs are searched again
+                    locations[i:j+1] = locations[i:j+1][::-1]
+                    current.distance = newDist
+                    dontLook.difference_update((ids[i-1],ids[i],ids[j],ids[j+1]))
+                    improved = True
+                    break
                 if improved:
-                    break  
-        return current_route
\ No newline at end of file
+                    break
+                dontLook.add(ids[i])
+        if current.distance >= self.distance:
+            return self
+        return type(self)(locations,current.requests,problem,True,current.distance,self.config)
+
+
+class CompactRoute(Route):
+    """
+    Class used to represent a route, with the same methods as Route. The sequence is
+    stored as an array of nodeIDs instead of a list of locations, and the profiles are
+    stored as arrays of floats, which uses less memory per route.
+    
+    Parameters
+    ----------
+    sequence : array of ints
+        the nodeIDs of the route sequence of locations.
+    locations : list of locations
+        the route sequence of locations, created from sequence when used.
+    """
+    @property
+    def locations(self):
+        nodes = self.problem.nodes
+        return [nodes[nodeID] for nodeID in self.sequence]
+    
+    @locations.setter
+    def locations(self,locations):
+        if isinstance(locations,array):
+            self.sequence = locations
+        else:
+            self.sequence = array('i',[loc.nodeID for loc in locations])
+            
+    def nodeSequence(self):
+        """
+        Method that returns the nodeIDs of the locations on the route
+        """
+        return self.sequence
+        
+    def removePositions(self,a,b):
+        """
+        Method that removes the locations at positions a < b from the route
+        """
+        del self.sequence[b]
+        del self.sequence[a]
+        
+    def copy(self):
+        """
+        Method that returns a copy of the route. The feasibility and distance are 
+        copied instead of checked again.
+        """
+        return CompactRoute(self.sequence[:],self.requests.copy(),self.problem,self.feasible,self.distance,self.config)
+    
+    def computeProfiles(self):
+        """
+        Method that computes the profiles of the route, see Route.computeProfiles, 
+        and stores them as arrays
+        """
+        super().computeProfiles()
+        self.arrivalTimes = array('d',self.arrivalTimes)
+        self.latestTimes = array('d',self.latestTimes)
+        self.loads = array('d',self.loads)
+        self.pathDistances = array('d',self.pathDistances)
+        self.openRequests = array('i',self.openRequests)
+        
+    def insertAt(self,request,i,j,distance=None):
+        """
+        Method that returns a new route where the pickup of a request is inserted 
+        at position i and the delivery at position j (after inserting the pickup),
+        see Route.insertAt
+        """
+        sequenceCopy = self.sequence[:]
+        sequenceCopy.insert(i,request.pickUpLoc.nodeID)
+        sequenceCopy.insert(j,request.deliveryLoc.nodeID)
+        requestsCopy = self.requests.copy()
+        requestsCopy.append(request)
+        if distance is not None:
+            return CompactRoute(sequenceCopy,requestsCopy,self.problem,True,distance,self.config)
+        return CompactRoute(sequenceCopy,requestsCopy,self.problem,config=self.config)
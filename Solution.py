@@ -6,13 +6,80 @@ Created on Tue Jul 26 13:54:49 2022
 """
 import numpy as np
 import sys
-from Route import Route
-from Problem import Location, PDPTW
-from Parameters import Parameters
+import math
+import heapq
+import bisect
+from Route import Route, CompactRoute
+from Problem import PDPTW
+from Config import Config
 
 
 
 
+class RequestSet:
+    """
+    Class that represents a set of requests that can also be indexed, such that
+    random.choice can pick from it. Adding, removing and membership take constant time.
+    A removed request is replaced by the last request, so the order is not preserved.
+
+    Attributes
+    ----------
+    requests : List of Requests
+        the requests in the set
+    positions : dict
+        maps the ID of each request to its position in requests
+    """
+    def __init__(self,requests=()):
+        self.requests = list(requests)
+        self.positions = {req.ID: pos for pos, req in enumerate(self.requests)}
+        
+    def add(self,request):
+        """
+        Method that adds a request to the set
+        """
+        self.positions[request.ID] = len(self.requests)
+        self.requests.append(request)
+        
+    def remove(self,request):
+        """
+        Method that removes a request from the set, returns the position it had
+        """
+        pos = self.positions.pop(request.ID)
+        lastRequest = self.requests.pop()
+        if pos < len(self.requests):
+            #move the last request into the gap
+            self.requests[pos] = lastRequest
+            self.positions[lastRequest.ID] = pos
+        return pos
+            
+    def restore(self,request,pos):
+        """
+        Method that undoes the removal of a request that had position pos, such that
+        the order is exactly as before the removal
+        """
+        if pos < len(self.requests):
+            #the request in its position was the last one before the removal
+            lastRequest = self.requests[pos]
+            self.positions[lastRequest.ID] = len(self.requests)
+            self.requests.append(lastRequest)
+            self.requests[pos] = request
+        else:
+            self.requests.append(request)
+        self.positions[request.ID] = pos
+            
+    def __contains__(self,request):
+        return request.ID in self.positions
+    
+    def __len__(self):
+        return len(self.requests)
+    
+    def __iter__(self):
+        return iter(self.requests)
+    
+    def __getitem__(self,pos):
+        return self.requests[pos]
+
+
 class Solution:
     """
     Method that represents a solution tot the PDPTW
@@ -23,26 +90,206 @@ class Solution:
         the problem that corresponds to this solution
     routes : List of Routes
          Routes in the current solution
-    served : List of Requests
+    served : RequestSet
         Requests served in the current solution
-    notServed : List of Requests
+    notServed : RequestSet
          Requests not served in the current solution 
+    routeOf : dict
+        maps the ID of each served request to the route that serves it
     distance : int
-        total distance of the current solution
+        total distance of the current solution, updated when the routes change
+    pathDistance : float
+        total distance of the routes that do not have an extremely large distance
+    nInfeasible : int
+        number of routes with an extremely large distance
+    journal : list
+        changes made since beginMove, used to undo a move. None if no move is made
+    ownedRoutes : set of Routes
+        routes that are not shared with other solutions, so they can be modified in place
+    config : Config
+        parameters of the run, by default the current values of Parameters
     """
-    def __init__(self,problem,routes,served,notServed): 
+    def __init__(self,problem,routes,served,notServed,config=None): 
         self.problem = problem
+        self.config = config if config is not None else Config.fromParameters()
         self.routes = routes
-        self.served = served
-        self.notServed = notServed
+        self.served = RequestSet(served)
+        self.notServed = RequestSet(notServed)
+        self.indexRoutes()
+        self.computeDistance()
+        self.journal = None
+        self.ownedRoutes = set()
+        
+    def indexRoutes(self):
+        """
+        Method that builds the index from requests to the routes that serve them
+        """
+        self.routeOf = dict()
+        for route in self.routes:
+            for req in route.requests:
+                self.routeOf[req.ID] = route
+                
+    def beginMove(self):
+        """
+        Method that starts a move (a destroy and repair). The changes to the solution
+        are recorded in the journal, such that the move can be undone with rollbackMove.
+        Routes are shared with copies of the solution, so they are only modified
+        after they are cloned (see cloneRoute).
+        """
+        self.journal = []
+        self.ownedRoutes = set()
+        self.journalDistance = (self.pathDistance,self.nInfeasible,self.distance)
+        
+    def commitMove(self):
+        """
+        Method that keeps the changes of the current move
+        """
+        self.journal = None
+        
+    def rollbackMove(self):
+        """
+        Method that undoes the changes of the current move, in reverse order
+        """
+        for change in reversed(self.journal):
+            kind = change[0]
+            if kind == "add":
+                self.routes.pop()
+            elif kind == "replace":
+                _, pos, oldRoute = change
+                self.routes.pop()
+                self.routes.insert(pos,oldRoute)
+                for req in oldRoute.requests:
+                    self.routeOf[req.ID] = oldRoute
+            elif kind == "substitute":
+                _, pos, oldRoute = change
+                self.routes[pos] = oldRoute
+                for req in oldRoute.requests:
+                    self.routeOf[req.ID] = oldRoute
+            elif kind == "serve":
+                _, req, pos = change
+                del self.routeOf[req.ID]
+                self.served.remove(req)
+                self.notServed.restore(req,pos)
+            elif kind == "unserve":
+                _, req, pos, route = change
+                self.routeOf[req.ID] = route
+                self.notServed.remove(req)
+                self.served.restore(req,pos)
+        self.journal = None
+        self.ownedRoutes = set()
+        self.pathDistance, self.nInfeasible, self.distance = self.journalDistance
+            
+    def record(self,*change):
+        """
+        Method that adds a change to the journal, if a move is made
+        """
+        if self.journal is not None:
+            self.journal.append(change)
+                
+    def addRoute(self,route):
+        """
+        Method that adds a route to the solution
+        """
+        self.routes.append(route)
+        for req in route.requests:
+            self.routeOf[req.ID] = route
+        self.ownedRoutes.add(route)
+        self.updateDistance(None,route.distance)
+        self.record("add")
+            
+    def replaceRoute(self,oldRoute,newRoute):
+        """
+        Method that replaces a route by a new route, which is placed at the end of the routes
+        """
+        pos = self.routes.index(oldRoute)
+        del self.routes[pos]
+        self.routes.append(newRoute)
+        for req in newRoute.requests:
+            self.routeOf[req.ID] = newRoute
+        self.ownedRoutes.add(newRoute)
+        self.updateDistance(oldRoute.distance,newRoute.distance)
+        self.record("replace",pos,oldRoute)
+        
+    def substituteRoute(self,oldRoute,newRoute):
+        """
+        Method that replaces a route by a new route in the same position
+        """
+        pos = self.routes.index(oldRoute)
+        self.routes[pos] = newRoute
+        for req in newRoute.requests:
+            self.routeOf[req.ID] = newRoute
+        self.ownedRoutes.add(newRoute)
+        self.updateDistance(oldRoute.distance,newRoute.distance)
+        self.record("substitute",pos,oldRoute)
+        
+    def cloneRoute(self,route):
+        """
+        Method that makes sure a route can be modified in place: a route that may be
+        shared with other solutions is replaced by a copy. Returns the route to modify.
+        """
+        if route in self.ownedRoutes:
+            return route
+        clone = route.copy()
+        self.substituteRoute(route,clone)
+        return clone
+        
+    def insertRequest(self,req,oldRoute,newRoute):
+        """
+        Method that marks an unserved request as served by newRoute. newRoute replaces
+        oldRoute, or is added to the solution if oldRoute is None
+        """
+        if oldRoute is None:
+            self.addRoute(newRoute)
+        else:
+            self.replaceRoute(oldRoute,newRoute)
+        self.served.add(req)
+        pos = self.notServed.remove(req)
+        self.record("serve",req,pos)
+        
+    def newRoute(self,locations,requests):
+        """
+        Method that creates a new route, as CompactRoute if config.compactRoutes
+        """
+        if self.config.compactRoutes:
+            return CompactRoute(locations,requests,self.problem,config=self.config)
+        return Route(locations,requests,self.problem,config=self.config)
+        
+    def changedRoutes(self):
+        """
+        Method that returns the routes of the solution that were created or modified in the current move
+        """
+        return [route for route in self.routes if route in self.ownedRoutes]
         
     def computeDistance(self):
         """
-        Method that computes the distance of the solution
+        Method that computes the distance of the solution from scratch
         """
-        self.distance = 0
+        self.pathDistance = 0
+        self.nInfeasible = 0
         for route in self.routes: 
-            self.distance += route.distance
+            self.updateDistance(None,route.distance,False)
+        self.distance = self.pathDistance + self.nInfeasible*sys.maxsize
+        
+    def updateDistance(self,oldDistance,newDistance,check=True):
+        """
+        Method that updates the distance of the solution when a route with oldDistance
+        is replaced by a route with newDistance (None if there is no such route).
+        The extremely large distances of infeasible routes are counted separately, 
+        such that they do not affect the precision of the other distances.
+        """
+        if oldDistance == sys.maxsize:
+            self.nInfeasible -= 1
+        elif oldDistance is not None:
+            self.pathDistance -= oldDistance
+        if newDistance == sys.maxsize:
+            self.nInfeasible += 1
+        elif newDistance is not None:
+            self.pathDistance += newDistance
+        self.distance = self.pathDistance + self.nInfeasible*sys.maxsize
+        if check and self.config.checkDistances:
+            total = sum(route.distance for route in self.routes)
+            if not math.isclose(self.distance,total,rel_tol=1e-9,abs_tol=1e-6):
+                raise Exception(f"Solution distance {self.distance} does not match recomputed {total}")
             
     def __str__(self): 
         """
@@ -86,7 +333,8 @@ class Solution:
     def executeShawRemoval(self, nRemove, random):
         """
         Method that executes Shaw Removal Heuristic: it removes requests that are somewhat similar. This is a variation of the method proposed by Ropke et al. (2006).
-        It only considers distance and demand as parameters to evaluate relatedness.
+        By default it only considers distance and demand as parameters to evaluate relatedness, 
+        with config.fullShaw the time windows are included as well.
 
         It's destroy method number 2 in the ALNS 
 
@@ -103,53 +351,45 @@ class Solution:
             return
         # Pick a random request (then find similar ones)
         req = random.choice(self.served)
-        candidates = self.evaluateRelatedness(req)
-        # print(candidates[0][1])
-        # print(candidates[1][1])
-        for i in range(nRemove):
-            if len(self.served) == 0:
-                break
-            self.removeRequest(candidates[i][1])
+        self.removeRequest(req)
+        candidates = self.evaluateRelatedness(req, nRemove)
+        for candidate in candidates:
+            self.removeRequest(candidate)
 
-    def evaluateRelatedness(self, req):
+    def evaluateRelatedness(self, req, nCandidates):
         """
-        Method taht calculates a relatedness parameter between a reference request (req) and all other requests in the problem, returning a list of requests ordered from greatest to lowest relatedness.
+        Method that returns the nCandidates served requests with the greatest relatedness 
+        parameter to a reference request (req), ordered from greatest to lowest relatedness.
+        Ties are broken by the order in served. With config.fullShaw the relatedness of 
+        Ropke and Pisinger is used, in which a smaller value means more related, so the
+        requests with the smallest values are returned, ordered from smallest to largest.
 
-        It uses only 2 parameters: distance and demand
+        The relatedness is taken from the matrix precomputed by PDPTW.getRelatedness.
         """
-
-        # Pick a random request (then find similar ones)
-        
-        self.removeRequest(req)
-        
-        relatedness = []
-        
-        for request in self.served:
-            # Distance component
-            pickUpDist = Location.getDistance(req.pickUpLoc, request.pickUpLoc)
-            requestDist = Location.getDistance(req.deliveryLoc, request.deliveryLoc)
-            R_dist = (pickUpDist+requestDist)  / self.problem.distMatrix_Max
-            
-            # Demand component (normalized)
-            req_demand = req.pickUpLoc.demand
-            request_demand = request.pickUpLoc.demand
-            
-            R_demand = abs(req_demand - request_demand) / self.problem.capacity # Assumes no loc has demand greater than vehicle capacity. Should not matter, since we are using difference between demands anyway, so this should alsways be between 0 and 1.
-            alpha = Parameters.alpha
-            beta = 1-alpha
-            # Calculate R (relatedness)
-            R =  alpha*R_dist + beta*R_demand # relatedness parameter
-            relatedness.append((req, request, R))
-            # print("Printing relatedness")
-            # print(relatedness[request])
-        relatedness.sort(key=lambda x: x[2], reverse = True) # Sort all requests based on relatedness
-        return relatedness
+        relatedness = self.problem.getRelatedness(self.config.alpha,self.config.fullShaw,self.config.shawWeights)
+        servedIDs = np.fromiter((request.ID for request in self.served),dtype=int,count=len(self.served))
+        R = relatedness[req.ID,servedIDs]
+        if self.config.fullShaw:
+            R = -R # the most related requests have the smallest values
+        n = min(nCandidates,len(servedIDs))
+        if n == 0:
+            return []
+        # n-th largest relatedness, requests tied with it are taken in the order of served
+        kth = -np.partition(-R,n-1)[n-1]
+        above = np.flatnonzero(R > kth)
+        tied = np.flatnonzero(R == kth)[:n-len(above)]
+        top = np.concatenate((above,tied))
+        order = top[np.lexsort((top,-R[top]))] # Sort on relatedness, then position
+        return [self.served[pos] for pos in order]
     
     
     def executeWorstReomval(self,nReomve, random):
         """
         Method that executes Worst Removal Heuristic: it removes the requests that appear to be placed in the wrong position in the solution. This is a variation of the method proposed by Ropke et al. (2006).
         
+        The saving of removing a request is computed from the neighbouring arcs (Route.removalSavings).
+        The savings are kept in a sorted list, and after each removal only the entries of the 
+        affected route are updated.
 
         It's destroy method number 3 in the ALNS 
 
@@ -165,40 +405,63 @@ class Solution:
         if len(self.served) == 0:
             return
         
+        # sorted list with (-saving, position in served, request ID), from worst to best placed
+        # ties are broken by the position in served
+        ranking = []
+        keys = dict()
+        for route in self.routes:
+            self.rankRemovals(route,ranking,keys)
+        ranking.sort()
         
         while nReomve > 0:
-            cost = []
             if len(self.served) == 0:
                 break
-            for req in self.served: # to find which route is now serving this requset
-                routefound = None
-                for route in self.routes:
-                    if req in route.requests:
-                        routefound = route
-                        break
-                if routefound is None: # Code should not reach here
-                    continue
-                # This can be impoved for efficency 
-                # insted of calcualting the whole tour, it is possible to calculate the two new line and minus it from the orginal
-                
-                orginalCost = routefound.distance
-                temp = routefound.copy()
-                temp.removeRequest(req)
-                newCost =temp.distance
-                deltaCost = orginalCost - newCost 
-                cost.append((req,deltaCost))
-                
-                
+            
             # randomization controlled by the parameter p
-            p = Parameters.p
+            p = self.config.p
             
-            cost.sort(key=lambda x: x[1] , reverse=True)   # sort by form worst based on the delta cost
             # The random removal
             randomN = random.random()
-            reqNumber = int(len(cost) * (randomN ** p))
+            reqNumber = int(len(ranking) * (randomN ** p))
+            req = self.served[ranking[reqNumber][1]]
+            
+            # the savings in the route change, and the last served request takes the position of req
+            for other in self.routeOf[req.ID].requests:
+                self.unrankRemoval(other,ranking,keys)
+            movedReq = self.served[len(self.served)-1]
+            self.unrankRemoval(movedReq,ranking,keys)
             
-            self.removeRequest(cost[reqNumber][0])
+            route = self.removeRequest(req)
+            
+            if movedReq is not req and self.routeOf[movedReq.ID] is not route:
+                pos = self.served.positions[movedReq.ID]
+                saving = self.routeOf[movedReq.ID].removalSavings()[movedReq.ID]
+                keys[movedReq.ID] = (-saving,pos,movedReq.ID)
+                bisect.insort(ranking,keys[movedReq.ID])
+            self.rankRemovals(route,ranking,keys,True)
             nReomve -= 1
+            
+    def rankRemovals(self,route,ranking,keys,keepSorted=False):
+        """
+        Method that adds the removal savings of all requests in a route to the ranking of 
+        worst removal, see executeWorstReomval
+        """
+        savings = route.removalSavings()
+        for req in route.requests:
+            key = (-savings[req.ID],self.served.positions[req.ID],req.ID)
+            keys[req.ID] = key
+            if keepSorted:
+                bisect.insort(ranking,key)
+            else:
+                ranking.append(key)
+                
+    def unrankRemoval(self,req,ranking,keys):
+        """
+        Method that removes a request from the ranking of worst removal, if present
+        """
+        key = keys.pop(req.ID,None)
+        if key is not None:
+            del ranking[bisect.bisect_left(ranking,key)]
 
     def executeRouteRemoval(self, random):
         """
@@ -221,35 +484,35 @@ class Solution:
 
         chosenRoutes = random.sample(self.routes, n)
         for route in chosenRoutes:
-            for request in route.requests:
+            for request in route.requests.copy():
                 self.removeRequest(request)
 
 
 
     def removeRequest(self,request):
         """
-        Method that removes a request from the solution
+        Method that removes a request from the solution. Returns the route it was removed from.
         """
-        #iterate over routes to find in which route the request is served
-        for route in self.routes:
-            if request in route.requests: 
-                #remove the request from the route and break from loop
-                route.removeRequest(request)
-                break
-        #update lists with served and unserved requests
-        self.served.remove(request)
-        self.notServed.append(request)
+        #look up in which route the request is served and remove it from the route
+        route = self.cloneRoute(self.routeOf.pop(request.ID))
+        oldDistance = route.distance
+        route.removeRequest(request)
+        self.updateDistance(oldDistance,route.distance)
+        #update sets with served and unserved requests
+        pos = self.served.remove(request)
+        self.notServed.add(request)
+        self.record("unserve",request,pos,route)
+        return route
         
     def copy(self):
         """
         Method that creates a copy of the solution and returns it
         """
-        #need a deep copy of routes because routes are modifiable
-        routesCopy = list()
-        for route in self.routes:
-            routesCopy.append(route.copy())
-        copy = Solution(self.problem,routesCopy,self.served.copy(),self.notServed.copy())
-        copy.computeDistance()
+        #the routes are shared with the copy, and cloned when one of the solutions modifies them
+        copy = Solution(self.problem,self.routes.copy(),self.served,self.notServed,self.config)
+        self.ownedRoutes = set()
+        #the sets with served and unserved requests are copied by the constructor
+        copy.pathDistance, copy.nInfeasible, copy.distance = self.pathDistance, self.nInfeasible, self.distance
         return copy
         
     def executeRandomInsertion(self,randomGen):
@@ -286,19 +549,38 @@ class Solution:
                     #insertion feasible, update routes and break from while loop
                     inserted = True
                     #print("Possible")
-                    self.routes.remove(randomRoute)
-                    self.routes.append(afterInsertion)
+                    self.insertRequest(req,randomRoute,afterInsertion)
                     break
             
             # if we were not able to insert, create a new route
             if not inserted:
                 #create a new route with the request
                 locList = [self.problem.depot,req.pickUpLoc,req.deliveryLoc,self.problem.depot]
-                newRoute = Route(locList,[req],self.problem)
-                self.routes.append(newRoute)
-            #update the lists with served and notServed requests
-            self.served.append(req)
-            self.notServed.remove(req)
+                newRoute = self.newRoute(locList,[req])
+                self.insertRequest(req,None,newRoute)
+         
+    def getBestInsertion(self,insertionCache,route,req):
+        """
+        Method that returns the best insertion of a request in a route as (i, j, dist), 
+        see Route.bestInsertion. Results are stored in insertionCache per route, so 
+        during a repair they are only computed again for the route that was modified.
+
+        Parameters
+        ----------
+        insertionCache : dict
+            maps a route to a dict with the best insertion of each request
+        route : Route
+            the route in which the request is inserted
+        req : Request
+            the request that should be inserted
+        """
+        routeCache = insertionCache.get(route)
+        if routeCache is None:
+            routeCache = insertionCache[route] = {}
+        insertion = routeCache.get(req)
+        if insertion is None:
+            insertion = routeCache[req] = route.bestInsertion(req)
+        return insertion
          
     def executeGreedyInsertion(self, randomGen):
         """
@@ -312,62 +594,89 @@ class Solution:
         randomGen : Random
             Used to generate random numbers
         """
-        
+        insertionCache = dict()
         while len(self.notServed) > 0:
-            reqBank = []
             bestRequest = None
-            bestRoute = None
+            bestInsertion = None
             bestDist = sys.maxsize
             inserted = False
             for route in self.routes:
                 candidateRequest = None
-                candidateRoute = None
+                candidateInsertion = None
                 candidateDist = sys.maxsize
                 for req in self.notServed:
 
-                    newRoute, dist = route.greedyInsert(req)
+                    insertion = self.getBestInsertion(insertionCache,route,req)
+                    dist = insertion[2]
 
-                    if newRoute == None:
-                        reqBank.append(req)
-                        
+                    if insertion[0] == None:
                         continue
                     elif dist<candidateDist:
                         candidateRequest = req
-                        candidateRoute = newRoute
+                        candidateInsertion = insertion
                         candidateDist = dist
-                if candidateRoute==None:
+                if candidateInsertion==None:
                     continue
                 if candidateDist < bestDist:
                     inserted = True
                     routeToRemove = route
                     bestRequest = candidateRequest
-                    bestRoute = candidateRoute
+                    bestInsertion = candidateInsertion
                     bestDist = candidateDist
             if inserted==True:
-                self.routes.remove(routeToRemove)
-                self.routes.append(bestRoute)
-                self.served.append(bestRequest)
-                self.notServed.remove(bestRequest)
+                bestRoute = routeToRemove.insertAt(bestRequest,bestInsertion[0],bestInsertion[1],bestInsertion[2])
+                #only the insertions in the modified route are outdated
+                del insertionCache[routeToRemove]
+                self.insertRequest(bestRequest,routeToRemove,bestRoute)
             if bestRequest == None:
                 #Impossible to insert in existing routes, create new route:
-                #print(reqBank)
                 req = randomGen.choice(self.notServed)
                 
                 locList = [self.problem.depot,req.pickUpLoc,req.deliveryLoc,self.problem.depot]
-                newRoute = Route(locList,[req],self.problem)
-                self.routes.append(newRoute)
-                self.served.append(req) #
-                self.notServed.remove(req)
-            #update the lists with served and notServed requests
-            # I think we should also apend to served and remove from not serves here
+                newRoute = self.newRoute(locList,[req])
+                self.insertRequest(req,None,newRoute)
+            
             
+    def getRegretOptions(self,insertionCache,routeSeq,req,k):
+        """
+        Method that returns the k best insertion options of a request, sorted on distance.
+        Each option is a tuple (dist, seq, route, insertion), where seq is the sequence
+        number of the route, used to break ties in the order of self.routes.
+        """
+        costs = []
+        for route in self.routes:
+            insertion = self.getBestInsertion(insertionCache,route,req)
+            if insertion[0] is not None:
+                costs.append((insertion[2],routeSeq[route],route,insertion))
+        return heapq.nsmallest(k,costs)
+    
+    def pushRegret(self,queue,entries,order,req,reqOptions):
+        """
+        Method that computes the regret of a request from its insertion options and pushes it
+        on the priority queue. Older entries of the request become outdated.
+        """
+        if len(reqOptions) == 0:
+            entries.pop(req,None)
+            return
+        regretCost = 0
+        for j in range(1,len(reqOptions)):
+            regretCost = regretCost + reqOptions[j][0] - reqOptions[0][0] # regret cost between best and j-th option
+        # largest regret first, ties are broken by selecting the request with best insertion cost
+        entry = (-regretCost,reqOptions[0][0],order[req],req)
+        entries[req] = entry
+        heapq.heappush(queue,entry)
             
     def executeRegretInsertion(self, randomG):
         """
         Method that inserts unserved requests in the solution using the Regret-k heuristic.
         The regret heuristic tries to improve upon the basic greedy heuristic by incorporating a kind of look ahead
         information when selecting the request to insert.
-        k is set to 2 right now.
+        k is given by config.Regretk.
+        
+        The k best insertion options of each request are kept, and the requests are kept in a 
+        priority queue on their regret. After an insertion, only the requests whose options 
+        involved the modified route, or that have a better option in the new route, are updated.
+        Outdated entries in the queue are skipped when popped.
         
         This is repair method number 3 in the ANLS.
         
@@ -379,76 +688,72 @@ class Solution:
             Used to generate random numbers
             
         """
-        k = Parameters.Regretk # we can change this, 
-        while len(self.notServed) > 0:
-            bestRequest = None
-            bestRoute = None
-            bestRegret = -sys.maxsize # to keep track of the largest Regret
-            bestCost = sys.maxsize
-            routeToRemove = None
+        k = self.config.Regretk # we can change this, 
+        insertionCache = dict()
+        routeSeq = {route: seq for seq, route in enumerate(self.routes)} # new routes are appended, so get a higher number
+        order = {req: nr for nr, req in enumerate(self.notServed)} # remaining ties are broken by the order in notServed
+        options = dict()
+        entries = dict()
+        queue = []
+        for req in self.notServed:
+            options[req] = self.getRegretOptions(insertionCache,routeSeq,req,k)
+            self.pushRegret(queue,entries,order,req,options[req])
             
-            for req in self.notServed:
-                costs = []
-                
-                for route in self.routes:
-                    newRoute, dist = route.greedyInsert(req)
-                    if newRoute is not None:
-                        costs.append((dist,newRoute,route))
-                        # newRoute is after insertion
-                        # roure is before 
-                
-                if len(costs) == 0:
-                    continue
-                
-                costs.sort(key=lambda x:x[0]) # sort based on dist
-              
-                regretCost = 0
-             
-                 
-                for j in range(1,min(k,len(costs))):
-                    regretCost = regretCost + costs[j][0] - costs[0][0] # regret cost between best and second option
-                if regretCost > bestRegret or (regretCost == bestRegret and costs[0][0] < bestCost): # Ties are broken by selecting the request with best insertion cost
-                        bestRegret = regretCost
-                        bestRequest = req
-                        bestRoute = costs[0][1]  # best route to insert
-                        routeToRemove = costs[0][2]
-                        #print(cost[0])
-                        bestCost = costs[0][0] # we need this for tie breaks
-                
-                       
+        while len(self.notServed) > 0:
+            #take the request with the largest regret, skipping outdated entries
+            entry = None
+            while len(queue) > 0:
+                candidate = heapq.heappop(queue)
+                if entries.get(candidate[3]) is candidate:
+                    entry = candidate
+                    break
                         
-            if bestRequest is None:
-                #print("$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$")
+            if entry is None:
                 req = randomG.choice(self.notServed)
                 locList = [self.problem.depot, req.pickUpLoc, req.deliveryLoc, self.problem.depot]
-                newRoute = Route(locList, [req], self.problem)
-                self.routes.append(newRoute)
-                self.served.append(req)
-                self.notServed.remove(req)
-            else:                  
-                self.routes.remove(routeToRemove)
-                self.routes.append(bestRoute)
-                self.served.append(bestRequest)
-                self.notServed.remove(bestRequest)
-            #break
-        #print(cost)
-        #print(costs[0])
+                newRoute = self.newRoute(locList,[req])
+                routeToRemove = None
+            else:
+                req = entry[3]
+                _, _, routeToRemove, insertion = options[req][0] # best route to insert
+                newRoute = routeToRemove.insertAt(req,insertion[0],insertion[1],insertion[2])
+                #only the insertions in the modified route are outdated
+                del insertionCache[routeToRemove]
+                del entries[req]
+            self.insertRequest(req,routeToRemove,newRoute)
+            routeSeq[newRoute] = len(routeSeq)
+            
+            #update the options of the other requests
+            for other in self.notServed:
+                otherOptions = options[other]
+                if any(option[2] is routeToRemove for option in otherOptions):
+                    otherOptions = options[other] = self.getRegretOptions(insertionCache,routeSeq,other,k)
+                else:
+                    insertion = self.getBestInsertion(insertionCache,newRoute,other)
+                    if insertion[0] is None:
+                        continue
+                    if len(otherOptions) == k and insertion[2] >= otherOptions[-1][0]:
+                        continue
+                    otherOptions.append((insertion[2],routeSeq[newRoute],newRoute,insertion))
+                    otherOptions.sort(key=lambda x: x[:2])
+                    del otherOptions[k:]
+                self.pushRegret(queue,entries,order,other,otherOptions)
    
    
-    def ApplyTwoOpt(self):
-        
-        routes = []
-        
-        for route in self.routes:
+    def ApplyTwoOpt(self,routes=None):
+        """
+        Method that applies 2-opt to the given routes of the solution, by default to all routes
+        """
+        if routes is None:
+            routes = self.routes.copy()
+        for route in routes:
             twoOpt = route.twoOpt()
             
             if twoOpt.distance < route.distance:
                 print("Two Opt Made")
             
-            routes.append(twoOpt)
-                
-        self.routes = routes
-        self.computeDistance()
+            if twoOpt is not route:
+                self.substituteRoute(route,twoOpt)
 
        
 
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""
+Compares the island model (IslandALNS) with independent runs (MultiStartALNS) that get the
+same budget: the same number of processes, seeds and iterations per process.
+Usage: python benchmark_islands.py [number of islands] [number of iterations] [instance ...]
+"""
+import sys
+import pandas as pd
+from Problem import PDPTW
+from Config import Config
+from ParallelALNS import MultiStartALNS, IslandALNS
+
+nRepetitions = 3
+
+if __name__ == "__main__":
+    nIslands = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    config = Config.fromParameters()
+    if len(sys.argv) > 2:
+        config = config.replace(nIterations=int(sys.argv[2]))
+    instances = sys.argv[3:] if len(sys.argv) > 3 else ["Instances/lc102.txt","Instances/lr205.txt","Instances/lrc104.txt"]
+    results = []
+    for fileName in instances:
+        problem = PDPTW.readInstance(fileName,config)
+        for repetition in range(nRepetitions):
+            seeds = range(repetition*nIslands+1,(repetition+1)*nIslands+1)
+            for name, method in (("independent",MultiStartALNS),("islands",IslandALNS)):
+                run = method(problem,4,3,seeds,nIslands,config)
+                run.execute()
+                results.append({"instance": fileName,
+                                "repetition": repetition,
+                                "method": name,
+                                "best_distance": run.bestDistance,
+                                "wall_time": run.wallTime,
+                                "cpu_time": sum(r["cpuTime"] for r in run.runs)})
+    df = pd.DataFrame(results)
+    print(df.pivot_table(index=["instance","repetition"],columns="method",values="best_distance"))
+    print(df.groupby("method")[["best_distance","wall_time","cpu_time"]].mean())
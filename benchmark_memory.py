@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+Measures the memory used per stored solution, with routes stored as lists of
+locations (Route) and as arrays of nodeIDs (CompactRoute).
+Usage: python benchmark_memory.py [instance ...]
+"""
+import sys
+import random
+import tracemalloc
+from Problem import PDPTW
+from Solution import Solution
+from Config import Config
+
+nCopies = 50
+
+def storeSolutions(problem,compact):
+    """
+    Constructs a solution and stores nCopies of it, with all routes copied and
+    their profiles computed, returns the memory per solution in bytes
+    """
+    config = Config.fromParameters().replace(compactRoutes=compact)
+    solution = Solution(problem,list(),list(),list(problem.requests),config)
+    solution.executeGreedyInsertion(random.Random(config.randomSeed))
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    stored = []
+    for i in range(nCopies):
+        routes = [route.copy() for route in solution.routes]
+        for route in routes:
+            route.computeProfiles()
+        stored.append(Solution(problem,routes,solution.served,solution.notServed,config))
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after-before)/nCopies, len(solution.routes)
+
+instances = sys.argv[1:] if len(sys.argv) > 1 else ["Instances/lc102.txt","Instances/lr205.txt"]
+for fileName in instances:
+    problem = PDPTW.readInstance(fileName)
+    locationBytes = sum(sys.getsizeof(loc) for loc in problem.nodes)
+    requestBytes = sum(sys.getsizeof(req) for req in problem.requests)
+    print(f"{fileName}: {len(problem.nodes)} locations ({locationBytes} bytes), {len(problem.requests)} requests ({requestBytes} bytes)")
+    for compact in (False,True):
+        perSolution, nRoutes = storeSolutions(problem,compact)
+        name = "CompactRoute" if compact else "Route"
+        print(f"  {name:12s}: {perSolution/1024:8.1f} KiB per solution ({nRoutes} routes)")
@@ -1,71 +1,40 @@
-import Problem, Solution, Route
-from ALNS import ALNS
-from Parameters import Parameters
+from ExperimentHarness import ExperimentHarness
 import numpy as np
 import os
-import time
+import sys
 import pandas as pd
 
+# Calibration of one parameter on all instances. The runs are stored in
+# log/experiments/<sweep>.csv, an interrupted sweep continues where it stopped.
+# Usage: python experiment.py [sweep] [number of processes]
+
+# sweep: (parameter, values, summary file, column of the values in the summary file)
+sweeps = {
+    "minNBH": ("minSizeNBH", np.arange(0, 45, 5).tolist(), "minNBHsize.csv", "minNBH"),
+    "maxNBH": ("maxSizeNBH", np.arange(10, 45, 5).tolist(), "maxNBHsize.csv", "maxNBHsize"),
+    "tempControl": ("startTempControl", [0.05, 0.1, 0.2, 0.3, 0.5, 0.8], "tempControl.csv", "temp"),
+    "coolingRate": ("coolingRate", [0.1, 0.3, 0.5, 0.6, 0.7, 0.8, 0.9], "Coolingrate.csv", "temp"),
+    "updateSpeed": ("updateSpeed", np.arange(0, 1, 0.1).tolist(), "UpdateSpeedCalibration.csv", "updateSpeed"),
+    "shaw": ("alpha", [0, 0.1, 0.25, 0.5, 0.75, 1], "ShawRemoval.csv", "alpha"),
+}
+seeds = [0] # the calibrations so far used the first seed only
 
-a = 0
-b = 45
-s = 5
-
-values = np.arange(a, b, s).tolist()
-
-#tempControl = [0.05 ,0.1, 0.2, 0.3, 0.5, 0.8]
-#colling_rate = [0.1,0.3,0.5,0.6,0.7,0.8,0.9]
 instance_dir = "Instances"
 
 # Get a list of all files in the Instances directory
-instance_files = os.listdir(instance_dir)
-
-
-
-
-
-FinalResulats = []
-for instance_file in instance_files: # this is AI genrated
-# Construct the full path to the instance file
-    for i in values:
-        results = []
-        
-        for randomSeed in range(3):
-            testI = os.path.join(instance_dir, instance_file)
-          
-            Parameters.randomSeed = randomSeed
-            Parameters.minSizeNBH = i
-         
-            problem = Problem.PDPTW.readInstance(testI)
-            print(problem)
-            nDestroyOps = 4
-            nDestroyOps = 4
-            nRepairOps = 3
-            alns = ALNS(problem,nDestroyOps,nRepairOps)
-            starttime = time.time()        
-            alns.execute()                    
-            #print(alns.bestSolution.distance)
-                
-                
-
-      
-            results.append({'distance': alns.bestSolution.distance})
-            
-            break
-        
-        #print(results)
-        avg_distance = np.mean([res['distance'] for res in results])            
-        #avg_time = np.mean([res['time'] for res in results])
-    
-        FinalResulats.append({
-    'instance' : os.path.basename(alns.problem.name),
-    'minNBH': i,
-    'average best distance': alns.bestSolution.distance,
-    #'average time': avg_time
-    })
-    
-#print(FinalResulats)
-
-df = pd.DataFrame(FinalResulats)
-df.to_csv("minNBHsize.csv")
-#print(df)
\ No newline at end of file
+instance_files = [os.path.join(instance_dir, instance_file) for instance_file in os.listdir(instance_dir)]
+
+if __name__ == "__main__":
+    sweep = sys.argv[1] if len(sys.argv) > 1 else "minNBH"
+    nWorkers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    parameter, values, summary_file, column = sweeps[sweep]
+
+    harness = ExperimentHarness(f"log/experiments/{sweep}.csv", instance_files, {parameter: values}, seeds, nWorkers)
+    harness.execute()
+
+    # average best distance over the seeds, per instance and value
+    df = harness.results()
+    FinalResulats = df.groupby(['instance', parameter], sort=False)['best_distance'].mean().reset_index()
+    FinalResulats.columns = ['instance', column, 'average best distance']
+    FinalResulats.to_csv(summary_file)
+    print(FinalResulats)
@@ -0,0 +1,55 @@
+from ExperimentHarness import ExperimentHarness
+from Config import Config
+import numpy as np
+import os
+import sys
+import pandas as pd
+
+# --- Experiment Setup ---
+# Compares the ALNS with granular neighbourhoods (Config.granularity) to the ALNS
+# that evaluates all insertion positions, on time and best distance.
+# Usage: python experiment_granularity.py [number of iterations] [number of processes]
+instance_dir = "Instances"
+output_csv_file = "log/granularity_experiment_results.csv"
+
+granularities = [None, 10, 20, 40]
+seeds = [1, 2, 3]
+if __name__ == "__main__":
+    baseConfig = Config.fromParameters()
+    if len(sys.argv) > 1:
+        baseConfig = baseConfig.replace(nIterations=int(sys.argv[1]))
+    nWorkers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+
+    instance_files = [os.path.join(instance_dir, instance_file) for instance_file in os.listdir(instance_dir)]
+
+    harness = ExperimentHarness(f"log/experiments/granularity_{baseConfig.nIterations}.csv", instance_files,
+                                {"granularity": granularities}, seeds, nWorkers, baseConfig)
+    harness.execute()
+    results = harness.results()
+
+    df = pd.DataFrame({
+        'instance': results['instance'],
+        'granularity': [int(g) if g == g else 'all' for g in results['granularity']],
+        'seed': results['seed'],
+        'best_distance': results['best_distance'],
+        'time': results['cpu_time']
+    })
+    df.to_csv(output_csv_file, index=False)
+    print(f"Results saved to {output_csv_file}")
+
+    # time saved and distance lost compared to evaluating all positions, per run
+    reference = df[df['granularity'] == 'all'].set_index(['instance', 'seed'])
+    summary = []
+    for granularity in granularities[1:]:
+        runs = df[df['granularity'] == granularity].set_index(['instance', 'seed'])
+        # runs with infeasible routes have extremely large distances, they are not compared
+        finite = (runs['best_distance'] < sys.maxsize) & (reference['best_distance'] < sys.maxsize)
+        gap = (runs['best_distance'][finite] / reference['best_distance'][finite] - 1) * 100
+        summary.append({
+            'granularity': granularity,
+            'time': runs['time'].sum(),
+            'time saved (%)': (1 - runs['time'].sum() / reference['time'].sum()) * 100,
+            'distance gap (%)': np.mean(gap)
+        })
+    print(f"Evaluating all positions: {reference['time'].sum():.1f} seconds")
+    print(pd.DataFrame(summary))
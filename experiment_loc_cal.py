@@ -1,33 +1,25 @@
 # -*- coding: utf-8 -*-
 
-import Problem, Solution, Route
-from ALNS import ALNS
-from Parameters import Parameters
+from ExperimentHarness import ExperimentHarness
+from Config import Config
 import os
+import sys
 #lr112
 
+# Usage: python experiment_loc_cal.py [number of processes]
 instance_dir = "Instances"
-instance_files = os.listdir(instance_dir)
+instance_files = [os.path.join(instance_dir, inst) for inst in os.listdir(instance_dir)]
 
 
 alphas = [0, 0.1, 0.25, 0.5, 0.75, 1]
-results = []
-
-for inst in instance_files:
-
-    for alpha in alphas:
-        Parameters.alpha = alpha
-        Parameters.nIterations = 2
-        testI = os.path.join(instance_dir, inst)
-        problem = Problem.PDPTW.readInstance(testI)
-        print(problem)
-        nDestroyOps = 4
-        nRepairOps = 3
-        alns = ALNS(problem,nDestroyOps,nRepairOps)
-        alns.execute()
-        results.append((alpha, float(alns.bestSolution.distance)))
-        
-
-print(results)    
 
+if __name__ == "__main__":
+    nWorkers = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    config = Config.fromParameters().replace(nIterations=2)
+    harness = ExperimentHarness("log/experiments/loc_cal.csv", instance_files, {"alpha": alphas},
+                                [config.randomSeed], nWorkers, config)
+    harness.execute()
+    df = harness.results()
+    results = list(zip(df['alpha'], df['best_distance']))
 
+    print(results)    
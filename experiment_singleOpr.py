@@ -1,104 +1,66 @@
-import Problem, Solution, Route
-from ALNS import ALNS
-from Parameters import Parameters
-import numpy as np
+from ExperimentHarness import ExperimentHarness
+from Config import Config
 import os
+import sys
 import time
 import pandas as pd
-import sys
+
+# Runs every combination of a single destroy and repair operator (without the battery
+# constraint) and compares the best one per instance to the ALNS with all operators.
+# Runs of the ALNS with all operators made by other experiments are taken from the ResultStore.
+# Usage: python experiment_singleOpr.py [number of processes]
 
 instance_dir = "Instances"
 
 # Get a list of all files in the Instances directory
-instance_files = os.listdir(instance_dir)
+instance_files = [os.path.join(instance_dir, instance_file) for instance_file in os.listdir(instance_dir)]
 print(instance_files)
 
 destroyList = [1,2,3,4]
 repairList = [1,2,3]
-tot_results = []
-
-bestCombinations = []
-
-tot_timeStart = time.time()
-for file in instance_files:
-    inst = os.path.join(instance_dir, file)
-    instName = inst.replace("Instances/", "")
-    instName = instName.replace(".txt", ".csv")
-    fileName = f"log/singleOpr/singleOprExp_{instName}"
-    bestComb_sol = sys.maxsize
-    print(f"My instance is {inst}")
-    
-    results = []
-
-    # Run the problem
-    starttime = time.time() # get the start time
-    problem = Problem.PDPTW.readInstance(inst)
-    print(problem)
-    alns = ALNS(problem,4,3)
-    starttime = time.time()        
-    alns.execute()
-    endtime = time.time() # get the end time
-    cpuTime = round(endtime-starttime)
-    normCost = alns.bestSolution.distance
-    normCpuTime = cpuTime
-
-    for destroyOpr in destroyList:
-        for repairOpr in repairList:
-            starttime = time.time() # get the start time
-            Parameters.useBattery = False
-            Parameters.overrideOpr = True
-            Parameters.destroy = destroyOpr
-            Parameters.repair = repairOpr
-
-            
-            # Run the problem
-            problem = Problem.PDPTW.readInstance(inst)
-            print(problem)
-            alns = ALNS(problem,4,3)
-            starttime = time.time()        
-            alns.execute()
-
-            endtime = time.time() # get the end time
-            cpuTime = round(endtime-starttime)
 
-            # Store solution into a dict
-            result = {
-                "destroyOpr": int(destroyOpr),
-                "repairOpr": int(repairOpr),
-                "cost": float(alns.bestSolution.distance),
-                "cpuTime": int(cpuTime)
-            }
-            results.append(result)
-            
-            # Find best combination for inst
-            currentComb_sol = alns.bestSolution.distance
-            if currentComb_sol < bestComb_sol:
-                bestComb_sol = currentComb_sol
-                bestComb = (destroyOpr, repairOpr)
-                bestCpuTime = cpuTime
-    
-    # Store best combination of inst
-    bestCombination = {
-        "inst": instName,
-        "best Combination": bestComb,
-        "cost": bestComb_sol,
-        "cpuTime": bestCpuTime,
-        "normCost": normCost,
-        "normCpuTime": normCpuTime
-    }
-    bestCombinations.append(bestCombination)
+if __name__ == "__main__":
+    nWorkers = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    config = Config.fromParameters()
+    tot_timeStart = time.time()
 
-    # Create list with all the results (useful for future reference)
-    tot_results.append(results)
+    # the ALNS with all operators
+    normal = ExperimentHarness("log/singleOpr/allOperators.csv", instance_files, {}, [config.randomSeed], nWorkers, config)
+    normal.execute()
+    # a single destroy and repair operator
+    single = ExperimentHarness("log/singleOpr/singleOperators.csv", instance_files,
+                               {"destroy": destroyList, "repair": repairList}, [config.randomSeed], nWorkers,
+                               config.replace(useBattery=False, overrideOpr=True))
+    single.execute()
 
-    # store results as csv
-    results_df = pd.DataFrame(results)
-    results_df.to_csv(fileName)
+    normResults = normal.results().set_index('instance')
+    singleResults = single.results()
+    bestCombinations = []
+    for instance_file, results in singleResults.groupby('instance', sort=False):
+        instName = instance_file.replace(".txt", ".csv")
+        results_df = pd.DataFrame({
+            "destroyOpr": results['destroy'],
+            "repairOpr": results['repair'],
+            "cost": results['best_distance'],
+            "cpuTime": results['cpu_time'].round().astype(int)
+        }).reset_index(drop=True)
+        # store results as csv
+        results_df.to_csv(f"log/singleOpr/singleOprExp_{instName}")
 
-bestCombinations_df = pd.DataFrame(bestCombinations)
-bestCombinations_df.to_csv("log/singleOpr/bestCombinationForEachInstance.csv")
+        # Find best combination for inst
+        best = results_df.loc[results_df['cost'].idxmin()]
+        bestCombinations.append({
+            "inst": instName,
+            "best Combination": (int(best['destroyOpr']), int(best['repairOpr'])),
+            "cost": best['cost'],
+            "cpuTime": int(best['cpuTime']),
+            "normCost": normResults.loc[instance_file, 'best_distance'],
+            "normCpuTime": int(round(normResults.loc[instance_file, 'cpu_time']))
+        })
 
+    bestCombinations_df = pd.DataFrame(bestCombinations)
+    bestCombinations_df.to_csv("log/singleOpr/bestCombinationForEachInstance.csv")
 
-tot_timeEnd = time.time()
-tot_CPUtime = round(tot_timeEnd-tot_timeStart)
-print(tot_CPUtime)
\ No newline at end of file
+    tot_timeEnd = time.time()
+    tot_CPUtime = round(tot_timeEnd-tot_timeStart)
+    print(tot_CPUtime)
@@ -1,44 +1,31 @@
-import Problem
-from ALNS import ALNS
-from Parameters import Parameters
+from ExperimentHarness import ExperimentHarness
+from Config import Config
 import os
+import sys
 import pandas as pd
 
 # --- Experiment Setup ---
+# Usage: python experiment_two_opt.py [number of processes]
 instance_dir = "Instances"
 output_csv_file = "log/two_opt_experiment_results.csv"
 
-instance_files = os.listdir(instance_dir)
-final_results = []
-
-# Loop over each instance file
-for instance_file in instance_files:
-    # Loop over each 2-opt setting (True and False)
-    for use_two_opt in [True,False]:
-        
-        
-        Parameters.maketwoOpt = use_two_opt
-        
-        
-        instance_path = os.path.join(instance_dir, instance_file)
-        
-        
-        problem = Problem.PDPTW.readInstance(instance_path)
-        
-
-        alns = ALNS(problem, nDestroyOps=4, nRepairOps=3)
-        alns.execute()
-        
-
-        final_results.append({
-            'instance': instance_file,
-            'used_two_opt': use_two_opt,
-            'best_distance': alns.bestSolution.distance
-        })
-
-
-
-df = pd.DataFrame(final_results)
-df.to_csv(output_csv_file, index=False)
-print(f"Results saved to {output_csv_file}")
-print(df)
\ No newline at end of file
+instance_files = [os.path.join(instance_dir, instance_file) for instance_file in os.listdir(instance_dir)]
+
+if __name__ == "__main__":
+    nWorkers = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    config = Config.fromParameters()
+
+    # each instance with and without 2-opt
+    harness = ExperimentHarness("log/experiments/two_opt.csv", instance_files, {"maketwoOpt": [True, False]},
+                                [config.randomSeed], nWorkers, config)
+    harness.execute()
+
+    results = harness.results()
+    df = pd.DataFrame({
+        'instance': results['instance'],
+        'used_two_opt': results['maketwoOpt'],
+        'best_distance': results['best_distance']
+    })
+    df.to_csv(output_csv_file, index=False)
+    print(f"Results saved to {output_csv_file}")
+    print(df)
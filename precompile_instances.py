@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+"""
+Compiles all instances in the Instances directory to the instance cache, 
+such that later calls of PDPTW.readInstance load them in milliseconds.
+"""
+import sys
+from Problem import PDPTW
+
+instance_dir = sys.argv[1] if len(sys.argv) > 1 else "Instances"
+PDPTW.precompileInstances(instance_dir)
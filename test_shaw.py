@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+Checks that Shaw removal with the relatedness of Ropke and Pisinger (fullShaw) removes the
+requests that are closest to the first removed request.
+Usage: python -m pytest test_shaw.py
+"""
+import random
+from Problem import PDPTW
+from Solution import Solution
+from Config import Config
+
+
+def ropkePisinger(problem,weights):
+    """
+    Method that returns the relatedness of Ropke and Pisinger between all pairs of requests,
+    computed request by request, as a dict indexed by pairs of request IDs
+    """
+    phi, chi, psi = weights
+    pairs = [(a,b) for a in problem.requests for b in problem.requests]
+    def distance(a,b):
+        return problem.distMatrix[a.pickUpLoc.nodeID][b.pickUpLoc.nodeID] + problem.distMatrix[a.deliveryLoc.nodeID][b.deliveryLoc.nodeID]
+    def time(a,b):
+        return abs(a.pickUpLoc.startTW - b.pickUpLoc.startTW) + abs(a.deliveryLoc.startTW - b.deliveryLoc.startTW)
+    def demand(a,b):
+        return abs(a.pickUpLoc.demand - b.pickUpLoc.demand)
+    maxDistance = max(1,max(distance(a,b) for a, b in pairs))
+    maxTime = max(1,max(time(a,b) for a, b in pairs))
+    maxDemand = max(1,max(demand(a,b) for a, b in pairs))
+    return {(a.ID,b.ID): phi*distance(a,b)/maxDistance + chi*time(a,b)/maxTime + psi*demand(a,b)/maxDemand for a, b in pairs}
+
+
+def test_fullShawRemovesClosestRequests():
+    config = Config.fromParameters().replace(fullShaw=True)
+    problem = PDPTW.readInstance("Instances/lc102.txt",config)
+    relatedness = ropkePisinger(problem,config.shawWeights)
+    for seed in range(5):
+        solution = Solution(problem,list(),list(),list(problem.requests.copy()),config)
+        solution.executeGreedyInsertion(random.Random(seed))
+        served = list(solution.served)
+        nRemove = 8
+        #the seed request is the first choice of the same random generator
+        seedRequest = random.Random(100+seed).choice(served)
+        solution.executeShawRemoval(nRemove,random.Random(100+seed))
+        removed = {request.ID for request in served} - {request.ID for request in solution.served}
+        others = sorted((request for request in served if request is not seedRequest),
+                        key=lambda request: relatedness[(seedRequest.ID,request.ID)])
+        closest = {request.ID for request in others[:nRemove]}
+        assert seedRequest.ID in removed
+        assert removed - {seedRequest.ID} == closest
@@ -1,10 +1,8 @@
-import Problem, Solution, Route
-from ALNS import ALNS
-from Parameters import Parameters
+from ExperimentHarness import ExperimentHarness
+from Config import Config
 import numpy as np
 import os
-import time
-import pandas as pd
+import sys
 
 
 instance_dir = "Instances"
@@ -16,19 +14,14 @@ file_paths = []
 for path in instance_files:
     file_paths.append(str(f"{instance_dir}/{path}"))
 
-results = []
-for inst in file_paths:
-    testI = inst
-    problem = Problem.PDPTW.readInstance(testI)
-    print(problem)
-    nDestroyOps = 4
-    nRepairOps = 3
-    alns = ALNS(problem,nDestroyOps,nRepairOps)
-    alns.execute()
+# Usage: python tryForAllInst.py [number of processes]
+if __name__ == "__main__":
+    nWorkers = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    config = Config.fromParameters()
+    harness = ExperimentHarness("log/experiments/all_instances.csv", file_paths, {}, [config.randomSeed], nWorkers, config)
+    harness.execute()
 
-    results.append(alns.bestSolution.distance)
-
-print(results)
-print(np.mean(results))
-            
+    results = list(harness.results()['best_distance'])
 
+    print(results)
+    print(np.mean(results))